@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark for how long the bots take to import, i.e. the part of a cold
+start that's spent before they even connect to discord.
+
+Every bot pays for discord.py and aiohttp, so those are imported first and
+not counted. What's left is the time to import the bots' own modules and
+whatever they pull in, which is checked against a budget for each bot. It
+also checks none of the heavy dependencies that are only needed now and
+then get imported at startup.
+
+Each measurement is taken in a fresh interpreter, and the best of `runs` is
+reported. Bytecode caches are always written, as they would be by the bots,
+so only the first run pays for compiling. Exits with 1 if anything is over
+budget.
+
+Usage: ./bench_import.py [runs]
+"""
+
+import json, os, subprocess, sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# (bot, directory it runs from, modules it imports on startup, budget in ms)
+TARGETS = [
+    ('worldbot', 'wbu-worldbot', ['commands', 'wbubot'], 20),
+    ('wbunotify', '.', ['wbunotify'], 5),
+]
+
+# Imported by every bot anyway
+PRELOAD = ['discord', 'discord.ext.commands', 'aiohttp']
+
+# Only needed for rarely used features, must be imported on first use
+LAZY = ['pytz', 'bs4', 'requests', 'numpy', 'html']
+
+MEASURE = '''
+import json, sys, time
+import {preload}
+before = set(sys.modules)
+start = time.perf_counter()
+import {modules}
+secs = time.perf_counter() - start
+print(json.dumps({{'secs': secs, 'modules': sorted(set(sys.modules) - before)}}))
+'''
+
+
+def measure(directory, modules):
+    code = MEASURE.format(preload=', '.join(PRELOAD), modules=', '.join(modules))
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    out = subprocess.run([sys.executable, '-c', code], cwd=os.path.join(ROOT, directory),
+        env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(out)
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    ok = True
+    for bot, directory, modules, budget in TARGETS:
+        results = [measure(directory, modules) for _ in range(runs)]
+        ms = min(r['secs'] for r in results) * 1e3
+        loaded = results[0]['modules']
+        eager = [m for m in loaded if m.split('.')[0] in LAZY]
+
+        status = 'ok' if ms <= budget and not eager else 'OVER'
+        print(f'{bot:10} {ms:7.2f} ms  budget {budget:4} ms  {len(loaded):3} modules  {status}')
+        if eager:
+            print(f'{"":10} imported at startup: {", ".join(eager)}')
+        ok = ok and status == 'ok'
+
+    sys.exit(0 if ok else 1)
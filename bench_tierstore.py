@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the tierbot's `TierStore`, in a throwaway database.
+
+Compares a multi-line `add` done as one transaction against a transaction
+per name, times removing by name and by index from a long tier, and shows
+what the cached listing saves over reading the tier again.
+
+Usage: ./bench_tierstore.py [names]
+"""
+
+import asyncio, os, sys, tempfile, time
+
+from tierstore import TierStore
+
+
+def fmt(names):
+    return ''.join(f'{n}\n' for n in names)
+
+
+async def timed(name, n, coro_fn):
+    start = time.perf_counter()
+    for i in range(n):
+        await coro_fn(i)
+    secs = time.perf_counter() - start
+    print(f'{name:28} {secs / n * 1e3:9.3f} ms/op  ({n} ops)')
+
+
+async def main(count):
+    with tempfile.TemporaryDirectory() as d:
+        store = TierStore(os.path.join(d, 'tiers.db'), ['low', 'high'])
+        names = [f'name{i}' for i in range(count)]
+
+        await timed(f'add {count} in one batch', 1, lambda i: store.add('low', names))
+        await timed('add one at a time', 200, lambda i: store.add('high', [names[i]]))
+        await timed('remove by name', 200, lambda i: store.remove_name('low', names[i * 7]))
+        await timed('remove by index', 200, lambda i: store.remove_index('low', count // 2))
+
+        await timed('read tier', 20, lambda i: store.items('low'))
+        await timed('render, cached', 2000, lambda i: store.render('low', fmt))
+        store.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000))
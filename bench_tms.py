@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Benchmark for extracting Travelling Merchant stock from saved wiki API
+responses, comparing the streaming extractor against BeautifulSoup.
+
+Checks both extractors agree on every response, then reports time per
+response and peak memory for each. Needs beautifulsoup4 installed.
+
+Usage: ./bench_tms.py [iterations] [response.json ...]
+Defaults to every response saved in `fixtures/tms_*.json`.
+"""
+
+import glob, json, os, sys, timeit, tracemalloc
+
+from tmsparse import extract_tms_names, extract_tms_names_bs4
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_html(path: str):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f).get('parse').get('text').get('*')
+
+
+def peak_memory(fn, html):
+    tracemalloc.start()
+    fn(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench(name, fn, pages, iterations):
+    secs = min(timeit.repeat(lambda: [fn(h) for h in pages], number=iterations, repeat=5))
+    per_page = secs / iterations / len(pages)
+    peak = max(peak_memory(fn, h) for h in pages)
+    print(f'{name:10} {per_page*1e6:10,.1f} us/response  {peak:12,} bytes peak')
+    return per_page, peak
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    paths = sys.argv[2:] or sorted(glob.glob(os.path.join(FIXTURE_DIR, 'tms_*.json')))
+    pages = [load_html(p) for p in paths]
+
+    # Import cost is paid once per process, but it's most of bs4's footprint
+    tracemalloc.start()
+    import bs4
+    _, import_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for path, html in zip(paths, pages):
+        new, old = extract_tms_names(html), extract_tms_names_bs4(html)
+        assert new == old, f'{path}: {new} != {old}'
+
+    print(f'{len(pages)} response(s), bs4 import allocated {import_peak:,} bytes')
+    t_new, m_new = bench('streaming', extract_tms_names, pages, iterations)
+    t_old, m_old = bench('bs4', extract_tms_names_bs4, pages, iterations)
+    print(f'speedup {t_old/t_new:.2f}x, peak memory {m_old/m_new:.2f}x smaller')
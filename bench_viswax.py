@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Benchmark for vis wax predictions, comparing `predict` called once per day
+against `predict_many` computing every day at once with numpy.
+
+Checks both agree on every day, then reports the time to predict the whole
+range with each.
+
+Usage: ./bench_viswax.py [days] [start runedate]
+Defaults to a year from today.
+"""
+
+import sys, timeit
+
+from viswax import predict, predict_many, runedate_today
+
+
+def bench(name, fn, repeat=5):
+    secs = min(timeit.repeat(fn, number=1, repeat=repeat))
+    print(f'{name:10} {secs*1e3:10,.2f} ms')
+    return secs
+
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    start = int(sys.argv[2]) if len(sys.argv) > 2 else runedate_today()
+    runedates = list(range(start, start + days))
+
+    scalar, vectorised = [predict(d) for d in runedates], predict_many(runedates)
+    for d, old, new in zip(runedates, scalar, vectorised):
+        assert tuple(old) == tuple(new), f'runedate {d}: {new} != {old}'
+
+    print(f'{days} days from runedate {start}')
+    t_old = bench('predict', lambda: [predict(d) for d in runedates])
+    t_new = bench('numpy', lambda: predict_many(runedates))
+    print(f'speedup {t_old/t_new:.2f}x')
@@ -0,0 +1,118 @@
+import asyncio, logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import aiohttp
+from yarl import URL
+
+# Statuses worth retrying, everything else is returned or raised immediately
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    def __init__(self, msg: str, retry_after: float = None):
+        super().__init__(msg)
+        # Secs the server asked us to wait before trying again, if it did
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str):
+    """ Secs to wait from a Retry-After header, which is secs or an HTTP date """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class HttpFetcher:
+    """
+    Async HTTP GETs for the bots, sharing one pooled aiohttp session.
+
+    Requests time out after `timeout` secs and are retried up to `retries`
+    times with exponential backoff starting at `backoff` secs, or after as
+    long as the server's Retry-After says. Responses with an ETag or
+    Last-Modified header are remembered per URL, and later requests for the
+    same URL are made conditional so the server can answer 304 Not Modified
+    without resending the body. A 304 we have no body for is treated as a
+    miss, and the URL is fetched again without the validators.
+    """
+
+    def __init__(self, headers: dict = None, timeout: float = 10, retries: int = 3,
+            backoff: float = 1.0):
+        self.headers = headers or {}
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        # url -> (etag, last modified, body)
+        self._validators = dict()
+
+    def session(self) -> aiohttp.ClientSession:
+        # Sessions have to be created inside the running event loop
+        if not self._session or self._session.closed:
+            self._session = aiohttp.ClientSession(headers=self.headers, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+
+    async def get_text(self, url: str, params: dict = None) -> str:
+        return await self._get_text(url, params, conditional=True)
+
+    async def _get_text(self, url: str, params: dict, conditional: bool) -> str:
+        key = str(URL(url).update_query(params or {}))
+        cached = self._validators.get(key) if conditional else None
+
+        headers = {}
+        if cached:
+            etag, modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if modified:
+                headers['If-Modified-Since'] = modified
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session().get(url, params=params, headers=headers) as r:
+                    if r.status == 304:
+                        if cached and cached[2]:
+                            logging.debug(f'{url} not modified')
+                            return cached[2]
+                        if conditional:
+                            break
+                        raise FetchError(f'{url} returned 304 to an unconditional request')
+                    if r.status in RETRY_STATUSES:
+                        raise FetchError(f'{url} returned {r.status}',
+                            parse_retry_after(r.headers.get('Retry-After')))
+                    r.raise_for_status()
+
+                    body = await r.text()
+                    etag, modified = r.headers.get('ETag'), r.headers.get('Last-Modified')
+                    if etag or modified:
+                        self._validators[key] = (etag, modified, body)
+                    return body
+
+            except aiohttp.ClientResponseError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, FetchError) as e:
+                if attempt == self.retries:
+                    raise FetchError(f'Giving up on {url} after {attempt + 1} tries: {e}') from e
+                delay = getattr(e, 'retry_after', None)
+                if delay is None:
+                    delay = self.backoff * 2**attempt
+                logging.warning(f'Fetching {url} failed ({e}), retrying in {delay}s')
+                await asyncio.sleep(delay)
+
+        # Only reached on a 304 with no body cached to reuse
+        logging.warning(f'{url} not modified, but nothing is cached, fetching it again')
+        self._validators.pop(key, None)
+        return await self._get_text(url, params, conditional=False)
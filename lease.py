@@ -0,0 +1,101 @@
+import asyncio, atexit, sqlite3, threading, time
+
+
+class Lease:
+    """
+    Named lease shared between processes on the same host through a SQLite
+    database, so only one of several instances of a bot acts at a time.
+
+    The holder has to renew the lease every so often; if it doesn't renew
+    within `ttl` secs, e.g. because it crashed or hung, any other instance
+    can take it over. Every instance calls `renew` periodically, which
+    takes the lease if it's free and returns whether this instance holds it.
+    The lease is released on exit so a standby can take over straight away.
+
+    Every time the lease changes hands its `epoch` goes up. A holder stamps
+    what it writes to shared state with its epoch and checks `still_held`
+    before writing, so an old holder that hasn't noticed it was replaced
+    can't clobber the new one's writes, and readers can tell its late
+    writes apart.
+    """
+
+    def __init__(self, path: str, name: str, holder: str, ttl: float = 10):
+        self.path = path
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.held = False
+        self.epoch = 0
+        self._local = threading.local()
+
+        # Autocommit, transactions are started explicitly
+        self._db = sqlite3.connect(path, timeout=ttl, isolation_level=None,
+            check_same_thread=False)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS lease (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires REAL NOT NULL,
+            epoch INTEGER NOT NULL DEFAULT 0)''')
+        try:
+            # Lease files from before epochs
+            self._db.execute('ALTER TABLE lease ADD COLUMN epoch INTEGER NOT NULL DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass
+        atexit.register(self.release)
+
+    def try_acquire(self, now: float = None) -> bool:
+        """ Takes or renews the lease if possible, returns whether we hold it """
+        now = time.time() if now is None else now
+        db = self._db
+        # IMMEDIATE takes the write lock up front so two instances can't both
+        # see the lease as free
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT holder, expires, epoch FROM lease WHERE name = ?',
+                (self.name,)).fetchone()
+            held = row is None or row[0] == self.holder or row[1] < now
+            if held:
+                if row is None:
+                    epoch = 1
+                else:
+                    # Nobody else can have written anything if it's still ours
+                    epoch = row[2] if row[0] == self.holder else row[2] + 1
+                db.execute('INSERT OR REPLACE INTO lease (name, holder, expires, epoch) VALUES (?, ?, ?, ?)',
+                    (self.name, self.holder, now + self.ttl, epoch))
+                self.epoch = epoch
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        self.held = held
+        return held
+
+    def still_held(self, epoch: int) -> bool:
+        """
+        Whether we still hold the lease we got at `epoch`, i.e. nobody took
+        it over since. Can be called from any thread, to fence off writes.
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=self.ttl)
+        row = db.execute('SELECT holder, epoch FROM lease WHERE name = ?',
+            (self.name,)).fetchone()
+        return row is not None and row[0] == self.holder and row[1] == epoch
+
+    async def renew(self) -> bool:
+        """ `try_acquire` off the event loop, as it may wait on the file lock """
+        return await asyncio.get_event_loop().run_in_executor(None, self.try_acquire)
+
+    def current_holder(self, now: float = None):
+        """ (holder, expiry time) of the lease, or None if nobody has it """
+        now = time.time() if now is None else now
+        return self._db.execute('SELECT holder, expires FROM lease WHERE name = ? AND expires >= ?',
+            (self.name, now)).fetchone()
+
+    def release(self):
+        if not self.held:
+            return
+        self.held = False
+        # Expire it rather than delete it, so the epoch keeps counting up
+        self._db.execute('UPDATE lease SET expires = 0 WHERE name = ? AND holder = ?',
+            (self.name, self.holder))
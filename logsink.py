@@ -0,0 +1,112 @@
+import atexit, json, os, queue, threading, time
+from datetime import datetime, timezone
+
+# Sentinel telling the writer thread to flush and exit
+_CLOSE = object()
+
+
+class LogSink:
+    """
+    Append-only JSONL log file that is written from a background thread, so
+    logging never blocks the event loop on disk I/O.
+
+    `write` only timestamps the record and puts it on a queue. The writer
+    thread formats records in batches and flushes whenever `batch_size`
+    records are pending or the oldest pending record is `flush_secs` old.
+    Once the file grows past `max_bytes` it is rotated to `path.1`,
+    `path.2`, ... keeping `backups` old files.
+
+    Each line is a JSON object with a `ts` field (ISO 8601, UTC) plus
+    whatever keyword arguments were passed to `write`, so the logs can be
+    read back with `read_records`.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 16*1024*1024, backups: int = 5,
+            flush_secs: float = 1.0, batch_size: int = 256):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_secs = flush_secs
+        self.batch_size = batch_size
+        self.closed = False
+
+        self._queue = queue.SimpleQueue()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(
+            target=self._run, name=f'logsink-{path}', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, **fields):
+        if not self.closed:
+            self._queue.put((time.time(), fields))
+
+    def close(self):
+        """ Flush everything written so far and stop the writer thread """
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def _run(self):
+        batch = []
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not _CLOSE:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_secs
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+
+            if batch:
+                self._flush(batch)
+                batch = []
+            if item is _CLOSE:
+                break
+        self._file.close()
+
+    def _flush(self, batch):
+        lines = []
+        for ts, fields in batch:
+            tsstr = datetime.fromtimestamp(ts, timezone.utc).isoformat()
+            lines.append(json.dumps({'ts': tsstr, **fields}, ensure_ascii=False, default=str))
+        self._file.write('\n'.join(lines) + '\n')
+        self._file.flush()
+
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = f'{self.path}.{i}'
+            if os.path.exists(src):
+                os.replace(src, f'{self.path}.{i+1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+
+def read_records(path: str):
+    """
+    Yields the records in a log file written by `LogSink`. Lines that aren't
+    JSON, e.g. from before the switch to JSONL, are skipped.
+    """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(rec, dict):
+                yield rec
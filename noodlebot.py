@@ -6,6 +6,7 @@ import aiohttp
 import random
 import math
 import re
+from logsink import LogSink
 
 CHANNELS = ['crashing-of-the-bands']
 CHANNEL_IDS = [784600787988905985, 719133080928911420, 784577880922521610]
@@ -103,7 +104,7 @@ client = commands.Bot(
     self_bot = False,
     connector = conn)
 noodlebot = NoodleBot()
-msglog = open('messages.log', 'a')
+msglog = LogSink('messages.log')
 
 
 @client.check
@@ -242,7 +243,7 @@ async def pet(ctx):
 
 @client.listen('on_message')
 async def log_msgs(msg):
-    msglog.write(f'{msg.channel}\t{msg.author}\t{msg.content}\n')
+    msglog.write(channel=str(msg.channel), author=str(msg.author), content=msg.content)
 
 
 import sys
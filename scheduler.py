@@ -0,0 +1,180 @@
+import asyncio, heapq, itertools, traceback
+from datetime import datetime, time, timedelta, timezone
+from typing import Awaitable, Callable, List
+
+# Why we use our own scheduler instead of cron
+# These are intended to be drop-in bots that you can clone and run after
+# changing the constants up top, so I don't want to add additional config
+# steps with 'copy this into your cron' or 'run this script to copy shit
+# into your cron.d'. This keeps everything simple and self-contained.
+
+# A rule maps a UTC datetime to the next time a job should fire strictly
+# after it
+Rule = Callable[[datetime], datetime]
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def daily_at(*times: time) -> Rule:
+    """ Rule for firing at each of the given UTC times of day """
+    def rule(after: datetime):
+        after = after.astimezone(timezone.utc)
+        candidates = [datetime.combine(after.date() + timedelta(days=d), t, tzinfo=timezone.utc)
+            for d in (0, 1) for t in times]
+        return min(c for c in candidates if c > after)
+    return rule
+
+
+def every(interval: timedelta) -> Rule:
+    """ Rule for firing every `interval` """
+    def rule(after: datetime):
+        return after + interval
+    return rule
+
+
+class VirtualClock:
+    """
+    Clock that only moves when told to. Use with `Scheduler.run_due` instead
+    of `Scheduler.start` to step through a schedule in tests.
+    """
+
+    def __init__(self, start: datetime):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def advance(self, delta: timedelta):
+        self.current += delta
+
+
+class Job:
+    def __init__(self, name: str, rule: Rule, fn: Callable[[], Awaitable], grace: timedelta):
+        self.name = name
+        self.rule = rule
+        self.fn = fn
+        self.grace = grace
+        self.next_fire = None
+        self.last_fired = None
+        self.running = None
+        self.cancelled = False
+
+    def __repr__(self):
+        return f'Job({self.name}, next {self.next_fire})'
+
+
+class Scheduler:
+    """
+    Runs every periodic job in the process off a single timer task and a
+    priority queue of next fire times.
+
+    The timer never sleeps more than `MAX_SLEEP` at once and recomputes
+    delays from the wall clock every time it wakes, so it corrects itself
+    after the event loop stalls or the system clock jumps. A job that wakes
+    up later than its `grace` period is skipped instead of firing late.
+
+    Each occurrence fires at most once: the next fire time is always
+    computed strictly after the occurrence that just fired, and a job is
+    not started again while its previous run is still going.
+    """
+
+    MAX_SLEEP = 60.0
+
+    def __init__(self, clock: VirtualClock = None, log: Callable[[str], None] = None):
+        self.now = clock.now if clock else utcnow
+        self.log = log or (lambda msg: None)
+        self._jobs = dict()
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    # Job management
+    # ==============
+
+    def add(self, name: str, rule: Rule, fn: Callable[[], Awaitable],
+            grace: timedelta = timedelta(minutes=5)) -> Job:
+        """ Add a job, replacing any existing job with the same name """
+        self.cancel(name)
+        job = Job(name, rule, fn, grace)
+        self._jobs[name] = job
+        self._schedule(job, self.now())
+        if self._wakeup:
+            self._wakeup.set()
+        return job
+
+    def cancel(self, name: str):
+        """ Cancel a job. Returns true iff there was a job with that name """
+        job = self._jobs.pop(name, None)
+        if job:
+            job.cancelled = True
+        return job is not None
+
+    def get(self, name: str) -> Job:
+        return self._jobs.get(name)
+
+    def jobs(self) -> List[Job]:
+        return sorted(self._jobs.values(), key=lambda j: j.next_fire)
+
+    def _schedule(self, job: Job, after: datetime):
+        job.next_fire = job.rule(after)
+        heapq.heappush(self._heap, (job.next_fire, next(self._seq), job))
+
+    # Running
+    # =======
+
+    def start(self):
+        if not self._task:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            await self.run_due()
+
+            delay = self.MAX_SLEEP
+            if self._heap:
+                secs = (self._heap[0][0] - self.now()).total_seconds()
+                delay = min(delay, max(secs, 0))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_due(self) -> List[Job]:
+        """ Start every job that is due. Returns the jobs started """
+        now = self.now()
+        started = []
+        while self._heap and self._heap[0][0] <= now:
+            when, _, job = heapq.heappop(self._heap)
+            # Stale entry for a cancelled or replaced job
+            if job.cancelled or when != job.next_fire:
+                continue
+
+            late = now - when
+            if late > job.grace:
+                self.log(f'Skipping {job.name} for {when}, woke up {late} late')
+            elif job.running and not job.running.done():
+                self.log(f'Skipping {job.name} for {when}, previous run still going')
+            else:
+                job.last_fired = when
+                job.running = asyncio.ensure_future(self._call(job))
+                started.append(job)
+
+            self._schedule(job, max(now, when))
+            self.log(f'Next {job.name} at {job.next_fire:%a %H:%M:%S} UTC')
+        return started
+
+    async def _call(self, job: Job):
+        try:
+            await job.fn()
+        except Exception:
+            self.log(f'Job {job.name} failed:\n{traceback.format_exc()}')
@@ -3,8 +3,8 @@
 import discord
 import discord.ext.commands as commands
 import aiohttp
-import json
 import atexit
+from tierstore import TierStore
 
 TIERS = ['low', 'high']
 
@@ -14,52 +14,18 @@ def list_tostr(lst, include_numbers=False):
 	s = ''
 	for i in range(len(lst)):
 		if include_numbers:
-			s += f'{i}: {lst[i]}'
+			s += f'{i}: {lst[i]}\n'
 		else:
 			s += f'{lst[i]}\n'
 	return s
 
+def list_numbered(lst):
+	return list_tostr(lst, include_numbers=True)
 
-class TierBot(object):
-	# Lists are thread safe and if ppl remove and add at the same time
-	# they're fucked anyways because I'm too lazy
-	def __init__(self):
-		self.low = []
-		self.high = []
-
-	def to_file(self, path):
-		l = [self.low, self.high]
-		with open(path, 'w') as f:
-			json.dump(l, f)
-
-	def from_file(self, path):
-		with open(path, 'r') as f:
-			try:
-				l = json.load(f)
-			except json.decoder.JSONDecodeError:
-				l = []
-		# Only continue loading if file is well-defined
-		if len(l) == 2:
-			self.low = l[0]
-			self.high = l[1]
-
-	def get_low_str(self):
-		return list_tostr(self.low)
-
-	def get_high_str(self):
-		return list_tostr(self.high)
-
-	def get_lst(self, tier):
-		tier = tier.strip().lower()
-		if tier == 'low':
-			return self.low
-		elif tier == 'high':
-			return self.high
-		else:
-			return None
 
-	def __str__(self):
-		return str(self.low) + str(self.high)
+def parse_tier(tier):
+	tier = tier.strip().lower()
+	return tier if tier in TIERS else None
 
 
 conn = aiohttp.TCPConnector(ssl=False)
@@ -68,13 +34,15 @@ client = commands.Bot(
     case_insensitive = True,
     self_bot = False,
     connector = conn)
-tierbot = TierBot()
+# Every change is saved to DB_PATH as it's made. Lists saved to SAVE_PATH
+# by older versions are imported on first start
 SAVE_PATH = 'tiers.json'
-tierbot.from_file(SAVE_PATH)
-
-@atexit.register
-def write_to_file():
-	tierbot.to_file(SAVE_PATH)
+DB_PATH = 'tiers.db'
+tiers = TierStore(DB_PATH, TIERS)
+migrated = tiers.migrate(SAVE_PATH)
+if migrated:
+	print(f'Imported {migrated} names from {SAVE_PATH}')
+atexit.register(tiers.close)
 
 
 @client.listen('on_ready')
@@ -101,11 +69,11 @@ ROLE_HIGH = 790701293353172993
 ROLE_LOW = 790701649895096352
 
 
-def process_txt(txt):
+async def process_txt(txt):
 	if txt == '!high' or txt == '$high':
-		return 'High tier names:\n' + list_tostr(tierbot.high)
+		return 'High tier names:\n' + await tiers.render('high', list_tostr)
 	elif txt == '!low' or txt == '$low':
-		return 'Low tier names:\n' + list_tostr(tierbot.low)
+		return 'Low tier names:\n' + await tiers.render('low', list_tostr)
 	else:
 		return f'Invalid command: "{txt}". Please double check your spelling.'
 
@@ -135,7 +103,7 @@ def split2k(s: str):
 async def process_msg(msg):
 	if msg.channel.id == MESSAGE_CHANNEL:
 		txt = msg.content.strip().lower()
-		ret = process_txt(txt)
+		ret = await process_txt(txt)
 
 		# Handle >2k length cases
 		lines = split2k(ret)
@@ -194,7 +162,10 @@ def is_edit_channel(ctx):
 	commands.has_role(ROLE_OWNER),
 	commands.check(is_edit_channel))
 async def adminlist(ctx):
-	return f'High:\n{list_tostr(tierbot.high)}\n\nLow:{list_tostr(tierbot.low)}'
+	high = await tiers.render('high', list_numbered)
+	low = await tiers.render('low', list_numbered)
+	for l in split2k(f'High:\n{high}\nLow:\n{low}'):
+		await ctx.send(l)
 
 
 @client.command(
@@ -207,13 +178,12 @@ async def adminlist(ctx):
 	commands.check(is_edit_channel))
 @commands.max_concurrency(1, wait=True)
 async def add_to_tier(ctx, tier, *, items):
-	lst = tierbot.get_lst(tier)
-	if lst == None:
+	key = parse_tier(tier)
+	if key == None:
 		await ctx.send(f'Invalid tier: {tier}')
 		return
 
-	for itm in items.split('\n'):
-		lst.append(itm)
+	await tiers.add(key, items.split('\n'))
 
 	await ctx.send(f'Successfully added the following to {tier}:\n{items}')
 
@@ -228,26 +198,26 @@ async def add_to_tier(ctx, tier, *, items):
 	commands.check(is_edit_channel))
 @commands.max_concurrency(1, wait=True)
 async def remove_from_tier(ctx, tier, *, item):
-	lst = tierbot.get_lst(tier)
-	if lst == None:
+	key = parse_tier(tier)
+	if key == None:
 		await ctx.send(f'Invalid tier: {tier}')
 		return
 
 	if item == 'all':
-		lst.clear()
+		await tiers.clear(key)
 		await ctx.send(f'Removed all items from tier {tier}')
 		return
 
-	if item in lst:
-		lst.remove(item)
-		to_be_removed = item
-	elif item.isnumeric():
+	to_be_removed = await tiers.remove_name(key, item)
+	if to_be_removed is None and item.isnumeric():
 		idx = int(item)
-		if not (idx >= 0 and idx < len(lst)):
+		to_be_removed = await tiers.remove_index(key, idx)
+		if to_be_removed is None:
 			await ctx.send(f'Invalid index: {idx}')
 			return
-		to_be_removed = lst[idx]
-		del lst[idx]
+	if to_be_removed is None:
+		await ctx.send(f'Not in {tier}: {item}')
+		return
 
 	await ctx.send(f'Removed from {tier}: {to_be_removed}')
 
@@ -259,7 +229,7 @@ async def remove_from_tier(ctx, tier, *, item):
 	commands.has_role(ROLE_OWNER),
 	commands.check(is_edit_channel))
 async def get_state(ctx):
-    await ctx.send(str(tierbot))
+    await ctx.send(str([await tiers.items(t) for t in TIERS]))
 
 
 import sys
@@ -0,0 +1,173 @@
+import asyncio, json, os, sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+# Bumped once tiers.json has been imported, so it's only ever done once
+SCHEMA_VERSION = 1
+
+
+class TierStore:
+    """
+    Named lists of names ("tiers") kept in a SQLite database in WAL mode.
+
+    Every change is its own transaction and is on disk by the time the
+    awaited method returns, so nothing is lost if the bot is killed. The
+    database is only touched from one worker thread, which keeps it off the
+    event loop and applies changes in the order they were made.
+
+    Each name has a position in its tier, and the order of the tier is the
+    order of positions. New names go after the last one, and removing a
+    name leaves a gap instead of moving everything after it.
+
+    Rendered listings are cached per tier until the next change to it, so
+    answering `!low` and `!high` normally doesn't read the database at all.
+    """
+
+    def __init__(self, path: str, tiers: List[str]):
+        self.tiers = list(tiers)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tierstore')
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # Sync the WAL on every commit, not just on checkpoints
+        self._db.execute('PRAGMA synchronous=FULL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS tier_items (
+            tier TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (tier, pos))''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS tier_items_name ON tier_items (tier, name)')
+
+        # Tier -> formatter -> rendered listing, and a per-tier version so a
+        # render that raced with a change isn't cached
+        self._rendered: Dict[str, Dict[Callable, str]] = dict()
+        self._version: Dict[str, int] = {t: 0 for t in self.tiers}
+
+    # Database, only used from the worker thread once the bot is running
+    # ===================================================================
+
+    def _transaction(self, fn, *args):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            ret = fn(db, *args)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return ret
+
+    @staticmethod
+    def _items(db, tier):
+        return [r[0] for r in db.execute(
+            'SELECT name FROM tier_items WHERE tier = ? ORDER BY pos', (tier,))]
+
+    @staticmethod
+    def _add(db, tier, names):
+        last = db.execute('SELECT MAX(pos) FROM tier_items WHERE tier = ?', (tier,)).fetchone()[0]
+        start = 0 if last is None else last + 1
+        db.executemany('INSERT INTO tier_items (tier, pos, name) VALUES (?, ?, ?)',
+            [(tier, start + i, n) for i, n in enumerate(names)])
+
+    @staticmethod
+    def _remove_name(db, tier, name):
+        row = db.execute('SELECT pos FROM tier_items WHERE tier = ? AND name = ? ORDER BY pos LIMIT 1',
+            (tier, name)).fetchone()
+        if row is None:
+            return None
+        db.execute('DELETE FROM tier_items WHERE tier = ? AND pos = ?', (tier, row[0]))
+        return name
+
+    @staticmethod
+    def _remove_index(db, tier, idx):
+        row = db.execute('SELECT pos, name FROM tier_items WHERE tier = ? ORDER BY pos LIMIT 1 OFFSET ?',
+            (tier, idx)).fetchone()
+        if row is None:
+            return None
+        db.execute('DELETE FROM tier_items WHERE tier = ? AND pos = ?', (tier, row[0]))
+        return row[1]
+
+    @staticmethod
+    def _clear(db, tier):
+        db.execute('DELETE FROM tier_items WHERE tier = ?', (tier,))
+
+    def migrate(self, json_path: str) -> int:
+        """
+        Imports the lists saved in `json_path` by the old tierbot, once.
+        Returns the number of names imported, 0 if it was done before. Call
+        before the store is used.
+        """
+        db = self._db
+        if db.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+            return 0
+
+        lists = []
+        if os.path.exists(json_path):
+            with open(json_path, 'r') as f:
+                try:
+                    lists = json.load(f)
+                except json.decoder.JSONDecodeError:
+                    lists = []
+
+        def run(db):
+            count = 0
+            # Same as the old loader, only import a well-defined file
+            if len(lists) == len(self.tiers):
+                for tier, names in zip(self.tiers, lists):
+                    self._add(db, tier, names)
+                    count += len(names)
+            db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            return count
+        return self._transaction(run)
+
+    # Event loop side
+    # ===============
+
+    async def _run(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _write(self, tier: str, fn: Callable, *args):
+        self._invalidate(tier)
+        try:
+            return await self._run(self._transaction, fn, tier, *args)
+        finally:
+            self._invalidate(tier)
+
+    def _invalidate(self, tier: str):
+        self._version[tier] += 1
+        self._rendered.pop(tier, None)
+
+    async def items(self, tier: str) -> List[str]:
+        return await self._run(self._items, self._db, tier)
+
+    async def add(self, tier: str, names: List[str]):
+        """ Appends all of `names` to `tier` in one transaction """
+        await self._write(tier, self._add, list(names))
+
+    async def remove_name(self, tier: str, name: str):
+        """ Removes the first `name` in `tier`, returns it or None if not there """
+        return await self._write(tier, self._remove_name, name)
+
+    async def remove_index(self, tier: str, idx: int):
+        """ Removes the `idx`th name in `tier`, returns it or None if out of range """
+        return await self._write(tier, self._remove_index, idx)
+
+    async def clear(self, tier: str):
+        await self._write(tier, self._clear)
+
+    async def render(self, tier: str, fmt: Callable[[List[str]], str]) -> str:
+        """
+        `fmt(names)` for `tier`, cached for each `fmt` until the tier is
+        changed. `fmt` is the cache key, so pass the same function each time
+        rather than a new lambda.
+        """
+        s = self._rendered.get(tier, {}).get(fmt)
+        if s is None:
+            version = self._version[tier]
+            s = fmt(await self.items(tier))
+            if version == self._version[tier]:
+                self._rendered.setdefault(tier, dict())[fmt] = s
+        return s
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._db.close()
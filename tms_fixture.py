@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the runescape.wiki Travelling Merchant API, for testing
+wbunotify without the network.
+
+Serves a saved API response (default `fixtures/tms_template.json`) with an
+ETag and Last-Modified, answering conditional requests with 304. Use
+`--fail N` to make the first N requests fail with a 503 to exercise
+retries, `--retry-after SECS` to make those failures 429s that ask to wait
+SECS, and `--delay SECS` to slow every response down.
+
+Point the notifier at it with
+`TMS_TEMPLATE_ENDPOINT=http://127.0.0.1:8089/api.php ./wbunotify.py <token>`
+
+Usage: ./tms_fixture.py [--port PORT] [--fail N] [--retry-after SECS] [--delay SECS] [response.json]
+"""
+
+import argparse, asyncio, hashlib, os
+from email.utils import formatdate
+from aiohttp import web
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def make_app(body: bytes, fail: int = 0, delay: float = 0, retry_after: float = None):
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    modified = formatdate(usegmt=True)
+    state = {'requests': 0, 'not_modified': 0, 'failed': 0}
+
+    async def handle(request: web.Request):
+        state['requests'] += 1
+        if delay:
+            await asyncio.sleep(delay)
+        if state['failed'] < fail:
+            state['failed'] += 1
+            if retry_after is not None:
+                return web.Response(status=429, text='Fixture rate limit',
+                    headers={'Retry-After': str(retry_after)})
+            return web.Response(status=503, text='Fixture failure')
+
+        headers = {'ETag': etag, 'Last-Modified': modified}
+        if request.headers.get('If-None-Match') == etag or \
+                request.headers.get('If-Modified-Since') == modified:
+            state['not_modified'] += 1
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type='application/json', headers=headers)
+
+    app = web.Application()
+    app['state'] = state
+    app.router.add_get('/api.php', handle)
+    return app
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Serve a saved TMS API response')
+    ap.add_argument('response', nargs='?', default=os.path.join(FIXTURE_DIR, 'tms_template.json'))
+    ap.add_argument('--port', type=int, default=8089)
+    ap.add_argument('--fail', type=int, default=0, help='fail the first N requests')
+    ap.add_argument('--retry-after', type=float, default=None,
+        help='fail with a 429 asking to wait SECS instead of a 503')
+    ap.add_argument('--delay', type=float, default=0, help='delay every response by SECS')
+    args = ap.parse_args()
+
+    with open(args.response, 'rb') as f:
+        body = f.read()
+    web.run_app(make_app(body, args.fail, args.delay, args.retry_after), host='127.0.0.1', port=args.port)
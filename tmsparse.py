@@ -0,0 +1,65 @@
+from html.parser import HTMLParser
+from typing import Iterable, Iterator, List
+
+
+class TmsNameExtractor(HTMLParser):
+    """
+    Event-driven extractor for the item names in the wiki's Travelling
+    Merchant template output, i.e. the text of every `<span class="name">`.
+    No document tree is built: names are appended to `names` as each span
+    closes.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.names = []
+        # Span nesting depth inside the current name span, 0 when outside
+        self._depth = 0
+        self._buf = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'span':
+            return
+        if self._depth:
+            self._depth += 1
+            return
+        for k, v in attrs:
+            if k == 'class' and v and 'name' in v.split():
+                self._depth = 1
+                self._buf = []
+                return
+
+    def handle_endtag(self, tag):
+        if tag == 'span' and self._depth:
+            self._depth -= 1
+            if not self._depth:
+                self.names.append(''.join(self._buf))
+
+    def handle_data(self, data):
+        if self._depth:
+            self._buf.append(data)
+
+
+def iter_tms_names(chunks: Iterable[str]) -> Iterator[str]:
+    """ Yields names as they are found while feeding the html in chunks """
+    p = TmsNameExtractor()
+    for chunk in chunks:
+        p.feed(chunk)
+        yield from p.names
+        p.names.clear()
+    p.close()
+    yield from p.names
+
+
+def extract_tms_names(html: str) -> List[str]:
+    return list(iter_tms_names([html]))
+
+
+def extract_tms_names_bs4(html: str) -> List[str]:
+    """
+    The old BeautifulSoup based extractor. beautifulsoup4 is optional and only
+    imported here, this is kept for comparison in `bench_tms.py`.
+    """
+    from bs4 import BeautifulSoup
+    b = BeautifulSoup(html, 'html.parser')
+    return [s.text for s in b.find_all('span', {'class': 'name'})]
@@ -1,3 +1,4 @@
+import functools, json, os
 from datetime import date, datetime, timezone
 from typing import *
 
@@ -6,21 +7,54 @@ from typing import *
 # ==========================
 
 
-def java_lcg_next_int(seed, n, repeats=1):
-    multiplier = 0x5DEECE66D
-    mask = (1 << 48) - 1
-    addend = 0xB
-    seed = (seed ^ multiplier) & mask
-    for i in range(repeats):
-        seed = (seed * multiplier + addend) & mask
-    seed = (seed >> 17)
+LCG_MULTIPLIER = 0x5DEECE66D
+LCG_ADDEND = 0xB
+LCG_MASK = (1 << 48) - 1
+
+
+@functools.lru_cache(maxsize=None)
+def java_lcg_jump(steps):
+    """
+    Returns (a, c) such that advancing the LCG `steps` times is
+    `state * a + c`, composing the one-step transform by repeated squaring.
+    """
+    a, c = 1, 0
+    ma, mc = LCG_MULTIPLIER, LCG_ADDEND
+    while steps:
+        if steps & 1:
+            a, c = (a * ma) & LCG_MASK, (c * ma + mc) & LCG_MASK
+        ma, mc = (ma * ma) & LCG_MASK, (mc * ma + mc) & LCG_MASK
+        steps >>= 1
+    return a, c
+
+
+def java_lcg_output(state, n):
+    state = (state >> 17)
     # is power of 2
     if (n & (n-1) == 0):
-        return int(seed * n // 2**31)
-    slot = seed % n
+        return int(state * n // 2**31)
+    slot = state % n
     return slot
 
 
+def java_lcg_next_int(seed, n, repeats=1):
+    state = (seed ^ LCG_MULTIPLIER) & LCG_MASK
+    a, c = java_lcg_jump(repeats)
+    state = (state * a + c) & LCG_MASK
+    return java_lcg_output(state, n)
+
+
+def java_lcg_ints(seed, n, count):
+    """
+    Yields `java_lcg_next_int(seed, n, repeats=r)` for r = 1..count, stepping
+    the LCG once per value instead of restarting from the seed each time.
+    """
+    state = (seed ^ LCG_MULTIPLIER) & LCG_MASK
+    for _ in range(count):
+        state = (state * LCG_MULTIPLIER + LCG_ADDEND) & LCG_MASK
+        yield java_lcg_output(state, n)
+
+
 slots = ['Air', 'Water', 'Earth', 'Fire', 'Dust', 'Lava', 'Mist', 'Mud', 'Smoke', 'Steam',
          'Mind', 'Body', 'Cosmic', 'Chaos', 'Nature', 'Law', 'Death', 'Astral', 'Blood', 'Soul']
 rune_ids = list(range(554, 554+20))
@@ -34,8 +68,10 @@ def predict(runedate: int):
     slot1best = java_lcg_next_int(2**32 * runedate, 19)
     slot1scores[slot1best] = 30
     used = set()
+    # rolls[r-1] is the roll after r steps
+    rolls = list(java_lcg_ints(2**32 * runedate + 1, 29, 20))
     for offset in range(1, 20):
-        score = java_lcg_next_int(2**32 * runedate + 1, 29, repeats=offset+1)+1
+        score = rolls[offset]+1
         while score in used:
             score = (score+1) % 29
         slot1scores[(slot1best + offset) % 20] = score
@@ -51,9 +87,9 @@ def predict(runedate: int):
             slot2best += 1  # TODO: what does this actually do with the starting point for the alts?
         slot2subscores[slot2best] = 30
         used = set()
+        rolls = list(java_lcg_ints(multiplier * 2**32 * runedate + multiplier, 29, 20))
         for offset in range(1, 20):
-            score = java_lcg_next_int(
-                multiplier * 2**32 * runedate + multiplier, 29, repeats=offset+1)+1
+            score = rolls[offset]+1
             while score in used:
                 score = (score+1) % 29
             slot2subscores[(slot2best + offset) % 20] = score
@@ -63,6 +99,103 @@ def predict(runedate: int):
     return slot1scores, slot2scores
 
 
+def _np_next_ints(np, seeds, n, count):
+    """
+    Vectorised `java_lcg_ints` over an array of seeds. Returns an array of
+    shape (len(seeds), count). Multiplying in wrapping uint64 is exact here
+    since we only keep the low 48 bits.
+    """
+    mult, addend, mask = np.uint64(LCG_MULTIPLIER), np.uint64(LCG_ADDEND), np.uint64(LCG_MASK)
+    state = (seeds ^ mult) & mask
+    out = np.empty((len(seeds), count), dtype=np.uint64)
+    for i in range(count):
+        state = (state * mult + addend) & mask
+        out[:, i] = state >> np.uint64(17)
+    # n is never a power of 2 here, see `java_lcg_output`
+    return out % np.uint64(n)
+
+
+def _np_slot_scores(np, best, rolls):
+    """
+    Vectorised version of the score assignment in `predict`. `best` is the
+    best slot per day and rolls[:, r-1] the roll after r steps. Collisions
+    with already used scores are walked for all days at once.
+    """
+    days = np.arange(len(best))
+    scores = np.zeros((len(best), 20), dtype=np.int64)
+    scores[days, best % 20] = 30
+    used = np.zeros((len(best), 30), dtype=bool)
+    for offset in range(1, 20):
+        score = rolls[:, offset].astype(np.int64) + 1
+        clash = used[days, score]
+        while clash.any():
+            score[clash] = (score[clash] + 1) % 29
+            clash = used[days, score]
+        scores[days, (best + offset) % 20] = score
+        used[days, score] = True
+    return scores
+
+
+def predict_many(runedates: List[int]):
+    """
+    Same as `[predict(d) for d in runedates]`, but computes every day at once
+    with numpy. Falls back to calling `predict` if numpy isn't installed.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return [predict(d) for d in runedates]
+
+    rd = np.array(runedates, dtype=np.uint64) << np.uint64(32)
+    slot1best = _np_next_ints(np, rd, 19, 1)[:, 0].astype(np.int64)
+    slot1 = _np_slot_scores(np, slot1best, _np_next_ints(np, rd + np.uint64(1), 29, 20))
+
+    slot2 = []
+    for multiplier, final_offset in slot2_params:
+        m = np.uint64(multiplier)
+        best = (_np_next_ints(np, m * rd, 19, 1)[:, 0].astype(np.int64) + final_offset) % 19
+        best[best == slot1best] += 1
+        slot2.append(_np_slot_scores(np, best, _np_next_ints(np, m * rd + m, 29, 20)))
+
+    slot1, slot2 = slot1.tolist(), [s.tolist() for s in slot2]
+    return [(slot1[i], [s[i] for s in slot2]) for i in range(len(runedates))]
+
+
+# On-disk cache of predictions, {runedate: predict(runedate)}
+VISWAX_TABLE_PATH = 'viswax_table.json'
+VISWAX_TABLE_DAYS = 366
+_table = None
+
+
+def load_table(path: str = VISWAX_TABLE_PATH):
+    try:
+        with open(path) as f:
+            return {int(k): tuple(v) for k, v in json.load(f).items()}
+    except (OSError, ValueError):
+        return dict()
+
+
+def build_table(start: int, days: int = VISWAX_TABLE_DAYS, path: str = VISWAX_TABLE_PATH):
+    """ Predict `days` days from `start` and save them to `path` """
+    runedates = list(range(start, start + days))
+    table = dict(zip(runedates, predict_many(runedates)))
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(table, f)
+    os.replace(tmp, path)
+    return table
+
+
+def lookup(runedate: int):
+    """ `predict(runedate)` through the on-disk table, extending it if needed """
+    global _table
+    if _table is None:
+        _table = load_table()
+    if runedate not in _table:
+        _table = build_table(runedate)
+    return _table[runedate]
+
+
 def runedate_today() -> int:
     rd_start = date(2002, 2, 27)
     rd_today = datetime.now(timezone.utc).date()
@@ -83,11 +216,23 @@ def str_of_slot(t: List[Tuple[int, str]]) -> str:
     return ', '.join(pair_strs)
 
 
-def slot_messages():
-    runedate = runedate_today()
-    predicted = predict(runedate)
+def slot_messages(runedate: int = None):
+    if runedate is None:
+        runedate = runedate_today()
+    predicted = lookup(runedate)
     labeled = label_slots(predicted)
     top = [sorted(x, reverse=True)[:6] for x in labeled]
     to_str = [str_of_slot(x) for x in top]
     slot_msgs = f'Slot 1: {to_str[0]}\nSlot 2a: {to_str[1]}\nSlot 2b: {to_str[2]}\nSlot 2c: {to_str[3]}'
     return slot_msgs
+
+
+if __name__ == '__main__':
+    # Print predictions for the next N days, default a week
+    import sys
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    today = runedate_today()
+    for rd in range(today, today + days):
+        day = date.fromordinal(date(2002, 2, 27).toordinal() + rd)
+        print(f'Runedate {rd} ({day}):')
+        print(slot_messages(rd) + '\n')
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark for classifying messages in `parser.process_message`.
+
+Compares the Aho-Corasick automaton in `MessageClassifier` against the old
+chain of substring tests, with the easter eggs in config and with larger
+generated trigger tables, to find where `AUTOMATON_MIN_TRIGGERS` should be.
+
+Before timing, checks the classifier agrees with the old chain both ways
+round, on the parser corpus and chat lines and on `fuzz` random messages
+stitched together from pieces of the triggers, digits and noise. Run with
+`./bench_classify.py [iterations] [fuzz]`.
+"""
+
+import random, string, sys, timeit
+
+from classify import MessageClassifier, MsgKind
+from config import EASTER_EGGS
+from bench_parser import CORPUS
+
+CHAT = [
+    'list',
+    'whats the fc?',
+    'wtf is the fc',
+    'anyone got a spare world',
+    'cpkwinsagain lol',
+    '.take 5 elm',
+    '.wbu',
+    'ty all, see you next wave',
+    'is 42 a dupe of 44? someone said 44 was dead already',
+    'brb getting food',
+    '.host',
+    'no ditto, elm on 70 is beamed',
+]
+
+
+def classify_chain(eggs, cmd):
+    """
+    The old if/elif chain from `process_message`, except that an empty
+    message is a command instead of an IndexError
+    """
+    if cmd == 'list':
+        return MsgKind.LIST, None
+    elif 'fc' in cmd and '?' in cmd:
+        return MsgKind.FC_QUERY, None
+    elif 'cpkwinsagain' in cmd:
+        return MsgKind.CPK, None
+    elif cmd and cmd[0] in '0123456789':
+        return MsgKind.UPDATE, None
+    else:
+        for k, v in eggs.items():
+            if k in cmd:
+                return MsgKind.EASTER_EGG, v
+    return MsgKind.COMMAND, None
+
+
+def make_triggers(n):
+    rng = random.Random(0)
+    eggs = dict(EASTER_EGGS)
+    while len(eggs) < n:
+        k = '.' + ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 8)))
+        eggs[k] = f'response {len(eggs)}'
+    return eggs
+
+
+def fuzz_msgs(eggs, n):
+    """ `n` random messages, made to hit the triggers and their edge cases often """
+    rng = random.Random(1)
+    keys = list(eggs)
+    pieces = ['fc', '?', 'cpkwinsagain', 'cpkwins', 'list', ' ', ' ', '1', '42', 'f', 'c']
+    def piece():
+        r = rng.random()
+        if r < 0.3:
+            k = rng.choice(keys)
+            # Whole triggers, and prefixes and suffixes of them
+            return rng.choice([k, k[:rng.randint(1, len(k))], k[rng.randint(0, len(k) - 1):]])
+        if r < 0.6:
+            return rng.choice(pieces)
+        return ''.join(rng.choice(string.ascii_lowercase + '.:?!') for _ in range(rng.randint(1, 6)))
+    return [''.join(piece() for _ in range(rng.randint(0, 6))).strip() for _ in range(n)]
+
+
+def check(eggs, msgs):
+    automaton = MessageClassifier(eggs, automaton_at=0)
+    chain = MessageClassifier(eggs, automaton_at=sys.maxsize)
+    for m in msgs:
+        expected = classify_chain(eggs, m)
+        assert automaton.classify(m) == expected, ('automaton', m)
+        assert chain.classify(m) == expected, ('chain', m)
+
+
+def bench(name, eggs, msgs, fuzz, iterations):
+    check(eggs, msgs + fuzz_msgs(eggs, fuzz))
+
+    clf = MessageClassifier(eggs, automaton_at=0)
+    t_old = min(timeit.repeat(lambda: [classify_chain(eggs, m) for m in msgs], number=iterations, repeat=5))
+    t_new = min(timeit.repeat(lambda: [clf.classify(m) for m in msgs], number=iterations, repeat=5))
+    per = lambda t: t / iterations / len(msgs) * 1e6
+    used = 'automaton' if MessageClassifier(eggs).matcher else 'chain'
+    print(f'{name:16} chain {per(t_old):8.2f} us/msg  automaton {per(t_new):6.2f} us/msg  '
+        f'({t_old/t_new:5.2f}x, using {used})')
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    fuzz = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    msgs = [m.lower() for m in CORPUS + CHAT]
+    bench(f'{len(EASTER_EGGS)} easter eggs', EASTER_EGGS, msgs, fuzz, iterations)
+    for n in [100, 200, 400, 1000, 10000]:
+        eggs = make_triggers(n)
+        # Make sure some of the generated triggers actually get hit
+        hits = [f'ok {k} there' for k in list(eggs)[-5:]]
+        bench(f'{n} triggers', eggs, msgs + hits, fuzz // 10, max(iterations * 10 // n, 1))
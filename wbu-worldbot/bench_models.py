@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Memory and throughput benchmark for the `WbsWave` world registry.
+
+Reports the memory held by a fresh wave, the memory of a batch of parsed
+update objects, and how many updates per second can be parsed and applied.
+Run with `./bench_models.py [iterations]`.
+"""
+
+import sys, timeit, tracemalloc
+
+import parser
+from models import *
+from bench_parser import CORPUS
+
+
+def measure_alloc(fn):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    obj = fn()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return after - before, obj
+
+
+def bench_apply(iterations):
+    wave = WbsWave()
+    def run():
+        for line in CORPUS:
+            wave.update_world(parser.parse_update_command(line))
+    secs = min(timeit.repeat(run, number=iterations, repeat=5))
+    return iterations * len(CORPUS) / secs
+
+
+def bench_list(iterations):
+    wave = WbsWave()
+    for line in CORPUS:
+        wave.update_world(parser.parse_update_command(line))
+    def run():
+        wave.update_world_states()
+        for loc in Location:
+            wave.get_active_for_loc(loc)
+    secs = min(timeit.repeat(run, number=iterations, repeat=5))
+    return iterations / secs
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    wave_bytes, _ = measure_alloc(WbsWave)
+    updates_bytes, updates = measure_alloc(
+        lambda: [parser.parse_update_command(l) for l in CORPUS * 40])
+
+    print(f'wave:    {wave_bytes:12,} bytes')
+    print(f'updates: {updates_bytes / len(updates):12,.0f} bytes/update')
+    print(f'apply:   {bench_apply(iterations):12,.0f} updates/sec')
+    print(f'list:    {bench_list(iterations):12,.0f} lists/sec')
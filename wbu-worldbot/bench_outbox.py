@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Load test for the outbound message queue against a fake Discord.
+
+Simulates a burst of people joining voice at wave start, each generating a
+log line, and compares sending them inline against posting them to the
+`Outbox`. Discord's limits are scaled down by `SCALE` so it runs quickly.
+Run with `./bench_outbox.py [num_events]`.
+"""
+
+import asyncio, sys
+
+import outbox
+from fakediscord import FakeClient
+
+SCALE = 0.01
+CHANNEL = 1
+
+
+def make_client():
+    return FakeClient(latency=0.05 * SCALE, limit=5, window=5.0 * SCALE)
+
+
+async def handle_inline(client, i):
+    await client.get_channel(CHANNEL).send(f'12:00:{i:02}: __"Scout {i}" joined__ voice')
+
+
+async def handle_outbox(ob, i):
+    ob.post(CHANNEL, f'12:00:{i:02}: __"Scout {i}" joined__ voice', coalesce=True)
+
+
+async def run(name, events, handler, make_ctx, drain):
+    loop = asyncio.get_event_loop()
+    client = make_client()
+    ctx = make_ctx(client)
+
+    start = loop.time()
+    await asyncio.gather(*[handler(ctx, i) for i in range(events)])
+    handled = loop.time() - start
+    await drain(ctx)
+    done = loop.time() - start
+
+    ch = client.get_channel(CHANNEL)
+    print(f'{name:8} handlers {handled/SCALE*1000:9.1f}ms  delivered {done/SCALE*1000:9.1f}ms  '
+          f'messages {len(ch.sent):4}  rate limited {ch.ratelimit_hits:4}  (unscaled times)')
+
+
+async def main(events):
+    async def no_drain(client):
+        pass
+
+    async def drain_outbox(ob):
+        while any(q.worker for q in ob.queues.values()):
+            await asyncio.sleep(0)
+
+    outbox.CHANNEL_RATE = 1.0 / SCALE
+    await run('inline', events, handle_inline, lambda c: c, no_drain)
+    await run('outbox', events, handle_outbox, outbox.Outbox, drain_outbox)
+
+
+if __name__ == '__main__':
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    asyncio.run(main(events))
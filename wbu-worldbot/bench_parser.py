@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for `parser.parse_update_command`.
+
+Compares the single-pass tokenizer against the old prefix-scanning parser
+on a corpus of scout lines, checking that both produce identical updates
+before timing them. Run with `./bench_parser.py [iterations]`.
+"""
+
+import sys, timeit
+
+import parser
+from models import *
+
+CORPUS = [
+    '119dwf 10gc',
+    '119 mhs 4:30mins',
+    '119 mhs 4',
+    '28 dead',
+    '84 beamed02 hcf clear',
+    '10elmhcf7',
+    '12 elm hcm 5:30',
+    '14 dead',
+    '22 rdi beamed',
+    '22 rdi beamed :04',
+    '30 dwf broken 3',
+    '31 unk beaming',
+    '35 dwf mg hcs 6:12',
+    '39 elm dies :05',
+    '42 rdi * sus 8 gc lots of pkers here',
+    '44dead',
+    '45 elm mfs 2:40 mins',
+    '49 rdi cms 9 full of bots, 2 guards at :03',
+    '58: dwf: hcf: 7:45',
+    '70 elm',
+    '77 rdi hhm 11',
+    '86 dwf beamed 1 shs',
+    '96 unk dead mini',
+    '103 elm scm broke :06 host here',
+    '140 dwf fcm 3:03gc',
+]
+
+
+def can_consume(s: str, *toks):
+    for t in toks:
+        if s.startswith(t):
+            return True
+    return False
+
+def consume(s: str, *toks):
+    for t in toks:
+        if s.startswith(t):
+            return s[len(t):].lstrip(' :')
+    return s
+
+def legacy_parse_update_command(msg: str):
+    """ The prefix-scanning parser from v4.0.4, kept as a baseline """
+    msg = msg.strip().lower()
+    world_num, msg = parser.get_beg_number(msg)
+    if not world_num:
+        return None
+
+    update = World(world_num, update=True)
+    cmd = msg
+    time_found = False
+    debug(f'Parsing: {cmd}')
+    while cmd:
+        debug(f'Remaining: "{cmd}"')
+        cmd = cmd.lstrip()
+
+        if can_consume(cmd, 'mg', 'minigames', 'mini', 'sus', '*'):
+            cmd = consume(cmd, 'mg', 'minigames', 'mini', 'sus', '*')
+            update.suspicious = True
+        elif can_consume(cmd, 'dead'):
+            cmd = consume(cmd, 'dead')
+            update.state = WorldState.DEAD
+        elif can_consume(cmd, 'dies'):
+            cmd = consume(cmd, 'dies')
+            num, cmd = parser.get_beg_number(cmd)
+            if not num:
+                continue
+            update.time = WbsTime(int(num), 0)
+            update.state = WorldState.ALIVE
+        elif cmd.startswith('beaming'):
+            update.state = WorldState.BEAMING
+            cmd = consume(cmd, 'beaming')
+        elif parser.is_tents(cmd[0:3]):
+            update.tents = cmd[0:3]
+            cmd = cmd[3:]
+        elif parser.is_location(cmd[0:3]):
+            update.loc = parser.convert_location(cmd[0:3])
+            cmd = consume(cmd, 'elm', 'rdi', 'dwf', 'unk')
+        elif cmd.startswith('beamed'):
+            cmd = consume(cmd, 'beamed')
+            num, cmd = parser.get_beg_number(cmd)
+            update.time = WbsTime.get_abs_minute_or_cur(num).add_mins(10)
+            update.state = WorldState.ALIVE
+            time_found = True
+        elif can_consume(cmd, 'broken', 'broke'):
+            cmd = consume(cmd, 'broken', 'broke')
+            num, cmd = parser.get_beg_number(cmd)
+            update.time = WbsTime.get_abs_minute_or_cur(num).add_mins(5)
+            update.state = WorldState.ALIVE
+            time_found = True
+        elif cmd[0] in '0123456789' and not time_found:
+            mins, cmd = parser.get_beg_number(cmd)
+            secs, cmd = parser.get_beg_number(cmd)
+            secs = secs if secs else 0
+            if cmd.startswith('mins'):
+                cmd = consume(cmd, 'mins')
+            else:
+                cmd = consume(cmd, 'gc')
+                ticks = mins*60 + secs
+                total_secs = ticks*0.6
+                mins, secs = divmod(total_secs, 60)
+            update.time = WbsTime.current().add(WbsTime(int(mins), int(secs)))
+            update.state = WorldState.ALIVE
+            time_found = True
+        else:
+            update.notes = cmd
+            break
+
+    return update
+
+
+def as_tuple(w: World):
+    return (w.num, w.loc, w.state, w.tents, str(w.time), w.notes, w.suspicious)
+
+
+def check_equivalent():
+    # Pin the clock so relative times compare equal
+    now = WbsTime.current()
+    current = WbsTime.current
+    WbsTime.current = staticmethod(lambda: now)
+    try:
+        for line in CORPUS:
+            old = as_tuple(legacy_parse_update_command(line))
+            new = as_tuple(parser.parse_update_command(line))
+            assert old == new, f'{line!r}: {old} != {new}'
+    finally:
+        WbsTime.current = current
+
+
+def bench(fn, iterations):
+    def run():
+        for line in CORPUS:
+            fn(line)
+    secs = min(timeit.repeat(run, number=iterations, repeat=5))
+    return iterations * len(CORPUS) / secs
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    check_equivalent()
+
+    old = bench(legacy_parse_update_command, iterations)
+    new = bench(parser.parse_update_command, iterations)
+    print(f'legacy:    {old:12,.0f} lines/sec')
+    print(f'tokenizer: {new:12,.0f} lines/sec')
+    print(f'speedup:   {new/old:12.2f}x')
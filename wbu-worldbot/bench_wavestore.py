@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Recovery benchmark for `WaveStore`.
+
+Writes a simulated 20 minute wave to a temporary directory, one parsed
+update per line of the parser corpus plus some takes and calls, then
+checks the recovered wave matches the original and reports how long
+recovery took from the log alone and from a snapshot plus log.
+Run with `./bench_wavestore.py [updates]`.
+"""
+
+import os, sys, tempfile, time
+
+import parser
+from models import *
+from wavestore import WaveStore
+from bench_parser import CORPUS
+
+
+def simulate(path: str, updates: int, snapshot_every: int):
+    store = WaveStore(path, snapshot_every)
+    wave, _ = store.load()
+    for i in range(updates):
+        wave.update_world(parser.parse_update_command(CORPUS[i % len(CORPUS)]))
+        if i % 50 == 0:
+            wave.take_worlds(5, Location.UNKNOWN, i)
+            wave.add_to('worldhist', f'call {i}')
+    store.close()
+    return wave
+
+
+def recover(path: str):
+    store = WaveStore(path)
+    wave, stats = store.load()
+    store.close()
+    return wave, stats
+
+
+def bench(name, path, updates, snapshot_every):
+    wave = simulate(path, updates, snapshot_every)
+    wal_bytes = os.path.getsize(path + '.wal')
+    recovered, stats = recover(path)
+    assert recovered.to_dict() == wave.to_dict(), 'recovered wave differs'
+    recovered.check_indexes()
+    print(f"{name:10} {stats['ms']:8.2f} ms  {stats['replayed']:6} replayed  {wal_bytes:10,} log bytes")
+
+
+if __name__ == '__main__':
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as d:
+        bench('log only', os.path.join(d, 'a'), updates, updates * 10)
+        bench('snapshot', os.path.join(d, 'b'), updates, 500)
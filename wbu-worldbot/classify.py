@@ -0,0 +1,153 @@
+from collections import deque
+from enum import Enum, auto
+from typing import Dict, List, Tuple
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher. Builds an Aho-Corasick automaton over
+    `patterns` once, after which finding which of them occur in a text is a
+    single pass over it, no matter how many patterns there are.
+
+    Transitions are stored as one dict per state holding only the moves that
+    don't go back to depth <= 1, with failure links resolved at build time.
+    Anything else goes to the root's child for that character, or the root.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(patterns)
+
+        # Trie, state 0 is the root
+        goto: List[Dict[str, int]] = [dict()]
+        out: List[Tuple[int, ...]] = [()]
+        for i, p in enumerate(self.patterns):
+            s = 0
+            for c in p:
+                nxt = goto[s].get(c)
+                if nxt is None:
+                    nxt = goto[s][c] = len(goto)
+                    goto.append(dict())
+                    out.append(())
+                s = nxt
+            out[s] += (i,)
+
+        # Failure links, breadth first so every state's failure target is
+        # done before it
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        order = []
+        while queue:
+            r = queue.popleft()
+            order.append(r)
+            for c, s in goto[r].items():
+                f = fail[r]
+                while f and c not in goto[f]:
+                    f = fail[f]
+                fail[s] = goto[f].get(c, 0) if r else 0
+                out[s] += out[fail[s]]
+                queue.append(s)
+
+        # A state's moves are its own trie edges plus whatever its failure
+        # target would do. Moves to depth 1 are all root children, so they're
+        # left to the fallback
+        trans: List[Dict[str, int]] = [dict() for _ in goto]
+        depth1 = set(goto[0].values())
+        for s in order:
+            if s not in depth1:
+                trans[s].update(trans[fail[s]])
+            trans[s].update(goto[s])
+        self._root = goto[0]
+        self._trans = trans
+        self._out = out
+
+    def find(self, text: str) -> List[int]:
+        """ Indexes of the patterns found in `text`, in the order found """
+        trans, root, out = self._trans, self._root, self._out
+        found = []
+        s = 0
+        for c in text:
+            s = trans[s].get(c) or root.get(c, 0)
+            if out[s]:
+                found.extend(out[s])
+        return found
+
+
+class MsgKind(Enum):
+    LIST = auto()
+    FC_QUERY = auto()
+    CPK = auto()
+    UPDATE = auto()
+    EASTER_EGG = auto()
+    COMMAND = auto()
+
+
+# Below this many triggers (easter eggs plus the three fixed ones) a chain
+# of `in` tests beats the automaton, see bench_classify.py. The 9 easter
+# eggs in config are far below it, so today the automaton is never built. It's
+# only there for when the trigger table grows large
+AUTOMATON_MIN_TRIGGERS = 200
+
+
+class MessageClassifier:
+    """
+    Decides how `parser.process_message` handles a message. In order of
+    precedence, a message is:
+    - LIST: exactly `list`
+    - FC_QUERY: contains both `fc` and `?`
+    - CPK: contains `cpkwinsagain`
+    - UPDATE: starts with a digit
+    - EASTER_EGG: contains one of the `easter_eggs` keys, the first one in
+      the dict wins
+    - COMMAND: anything else, left for the command handler
+
+    With at least `automaton_at` triggers the message is classified in one
+    pass over its text with an Aho-Corasick automaton, which costs the same
+    however many triggers there are. With fewer, each `in` test is a fast
+    C-level scan and a chain of them is quicker than stepping the automaton
+    in Python, so that's what's used. That includes the easter eggs in
+    config, so the automaton is only for much larger trigger tables.
+
+    `classify` takes the stripped and lowercased message, and returns the
+    kind and for easter eggs the response.
+    """
+
+    # Indexes of the matcher's patterns, easter eggs come after the rest
+    FC, QUESTION, CPK, FIRST_EGG = 0, 1, 2, 3
+
+    def __init__(self, easter_eggs: Dict[str, str], automaton_at: int = AUTOMATON_MIN_TRIGGERS):
+        self.easter_eggs = dict(easter_eggs)
+        self.responses = list(easter_eggs.values())
+        self.matcher = None
+        if self.FIRST_EGG + len(easter_eggs) >= automaton_at:
+            self.matcher = AhoCorasick(['fc', '?', 'cpkwinsagain'] + list(easter_eggs))
+
+    def classify(self, cmd: str) -> Tuple[MsgKind, str]:
+        if cmd == 'list':
+            return MsgKind.LIST, None
+        if self.matcher is None:
+            return self._classify_chain(cmd)
+
+        found = self.matcher.find(cmd)
+        if self.FC in found and self.QUESTION in found:
+            return MsgKind.FC_QUERY, None
+        if self.CPK in found:
+            return MsgKind.CPK, None
+        if cmd and cmd[0] in '0123456789':
+            return MsgKind.UPDATE, None
+
+        eggs = [i for i in found if i >= self.FIRST_EGG]
+        if eggs:
+            return MsgKind.EASTER_EGG, self.responses[min(eggs) - self.FIRST_EGG]
+        return MsgKind.COMMAND, None
+
+    def _classify_chain(self, cmd: str) -> Tuple[MsgKind, str]:
+        if 'fc' in cmd and '?' in cmd:
+            return MsgKind.FC_QUERY, None
+        if 'cpkwinsagain' in cmd:
+            return MsgKind.CPK, None
+        if cmd and cmd[0] in '0123456789':
+            return MsgKind.UPDATE, None
+        for k, v in self.easter_eggs.items():
+            if k in cmd:
+                return MsgKind.EASTER_EGG, v
+        return MsgKind.COMMAND, None
@@ -1,24 +1,74 @@
-import textwrap
+import io, textwrap
 
 import discord
 from discord.ext import commands
 
 from config import *
 from models import *
+from wbstime import *
+from history import at_minute, describe_event
+from profiler import start_profile
 from wbubot import WbuBot
 import parser
 
 def register_commands(client: commands.Bot, wbu: WbuBot):
 
+	def wave(ctx: commands.Context) -> WbsWave:
+		""" The wave scouted in the channel a command was sent in """
+		return wbu.shard_for(ctx.channel).wave
+
 	@client.command(name='debug', brief='Shows debug information')
 	@commands.is_owner()
 	async def debug_cmd(ctx):
-		msg = wbu.wave.get_debug_info()
+		msg = wave(ctx).get_debug_info()
 		debug(msg)
 		for l in textwrap.wrap(msg, width=1900):
 			await ctx.send(l)
 
 
+	@client.command(name='profile', brief='Profile the bot for a while')
+	@commands.is_owner()
+	async def profile_cmd(ctx, secs: float = 10):
+		"""
+		Samples what the bot is doing every few ms for `secs`
+		seconds (10 by default, at most 60) and uploads the
+		stacks to the bot log channel, grouped by the task
+		they were running in. The file is in collapsed stack
+		format, for flamegraph.pl or speedscope.app.
+
+		The profile runs in the background and this command
+		returns straight away, so messages keep being handled
+		while it runs.
+		"""
+		secs = min(max(secs, 1), PROFILE_MAX_SECS)
+		try:
+			task = start_profile(secs, PROFILE_INTERVAL_SECS)
+		except RuntimeError as e:
+			await ctx.send(str(e))
+			return
+
+		async def upload():
+			try:
+				prof = await task
+				name = f'profile-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.folded'
+				data = io.BytesIO(prof.collapsed().encode('utf-8'))
+				await wbu.client.get_channel(CHANNEL_BOT_LOG).send(
+					f'```\n{prof.summary()}\n```', file=discord.File(data, filename=name))
+			except Exception as e:
+				await wbu.logr(f'Profile failed: {e}')
+
+		# Not awaited, commands for a wave run while holding its lock
+		wbu.client.loop.create_task(upload())
+		await ctx.send(f'Profiling for {secs:g}s, results go to <#{CHANNEL_BOT_LOG}>')
+
+
+	@client.command(name='jobs', brief='Show scheduled jobs')
+	@commands.is_owner()
+	async def jobs(ctx):
+		lines = [f'{j.name}: next at {j.next_fire:%a %H:%M:%S} UTC' for j in wbu.scheduler.jobs()]
+		await ctx.send('\n'.join(lines) or 'No jobs scheduled')
+
+
 	@client.command(name='version', brief='Show version')
 	async def version(ctx):
 		await ctx.send(f'Bot version v{VERSION}. Written by CraftyElk :D')
@@ -26,25 +76,30 @@ def register_commands(client: commands.Bot, wbu: WbuBot):
 	@client.command(name='instance', brief='Show instance')
 	@commands.is_owner()
 	async def version(ctx):
-		await ctx.send(f'Instance: {wbu.uuid}')
+		await ctx.send(f"Instance: {wbu.uuid} ({'active' if wbu.active else 'standby'})")
 
 	@client.command(name='ignoremode', brief='Enter ignoremode')
 	@commands.has_role(ROLE_HOST)
-	async def ignoremode(ctx):
+	async def ignoremode(ctx, arg: str = ''):
 		"""
 		Enter ignoremode. In ignoremode, the bot ignores all
 		input except for `.ignoremode disable` and will not 
 		send out any messages.
 
-		This is used for dev only, to silence the production
-		bot when the testing bot is running to prevent 2 
-		replies to each message.
+		Instances running from the same directory (or with the
+		same WORLDBOT_STATE_DIR) already elect one of them to
+		reply, so this isn't needed to run a testing bot next
+		to the production bot there.
 
-		This can also be used when the bot is misbehaving 
+		This can be used when the bot is misbehaving 
 		and we need to silence it. 
 
 		This command is only available to hosts.
 		"""
+		if arg == 'disable':
+			# In ignoremode `on_message` handles this before it gets here
+			await ctx.send('Not in ignoremode.')
+			return
 		wbu.ignoremode = True
 		await ctx.send(f'Going into ignore mode. Use `.ignoremode disable` to get out.')
 
@@ -83,8 +138,8 @@ def register_commands(client: commands.Bot, wbu: WbuBot):
 
 		This command is only available to hosts.
 		"""
-		summary = wbu.wave.get_wave_summary()
-		wbu.reset_wave()
+		summary = wave(ctx).get_wave_summary()
+		wbu.shard_for(ctx.channel).reset_wave()
 		await ctx.send(summary)
 
 
@@ -101,7 +156,7 @@ def register_commands(client: commands.Bot, wbu: WbuBot):
 		"""
 		vc = client.get_channel(CHANNEL_VOICE)
 		for m in vc.members:
-			wbu.wave.add_participant(m.display_name)
+			wave(ctx).add_participant(m.display_name)
 
 
 	@client.command(name='fc', brief='Set/list in-game fc')
@@ -113,36 +168,36 @@ def register_commands(client: commands.Bot, wbu: WbuBot):
 		instead. Only available to hosts.
 		"""
 		if not fc_name:
-			await ctx.send(f"FC: '{wbu.wave.fcname}'")
+			await ctx.send(f"FC: '{wave(ctx).fcname}'")
 		else:
-			wbu.wave.fcname = fc_name
-			await ctx.send(f"Setting FC to: '{wbu.wave.fcname}'")
+			wave(ctx).set_field('fcname', fc_name)
+			await ctx.send(f"Setting FC to: '{wave(ctx).fcname}'")
 
 
 	@client.command(name='host', brief='Set host')
 	async def host(ctx, host:str = ''):
 		""" Sets `host` as host. Uses caller if none specified. """
 		if host:
-			wbu.wave.host = host
-		wbu.wave.host = ctx.author.display_name
+			wave(ctx).set_field('host', host)
+		wave(ctx).set_field('host', ctx.author.display_name)
 		await ctx.message.add_reaction(REACT_CHECK)
 
 
 	@client.command(name='scout', brief='Add yourself to scout list')
 	async def scout(ctx):
-		wbu.wave.scoutlist.add(ctx.author.display_name)
+		wave(ctx).add_to('scoutlist', ctx.author.display_name)
 		await ctx.message.add_reaction(REACT_CHECK)
 
 
 	@client.command(name='anti', brief='Add yourself to anti list')
 	async def anti(ctx):
-		wbu.wave.antilist.add(ctx.author.display_name)
+		wave(ctx).add_to('antilist', ctx.author.display_name)
 		await ctx.message.add_reaction(REACT_CHECK)
 
 
 	@client.command(name='call', brief='Add msg to call history')
 	async def call(ctx, *, msg: str):
-		wbu.wave.worldhist.append(msg)
+		wave(ctx).add_to('worldhist', msg)
 		await ctx.message.add_reaction(REACT_CHECK)
 
 
@@ -166,14 +221,72 @@ def register_commands(client: commands.Bot, wbu: WbuBot):
 			worlds = [int(x) for x in args]
 
 		for w in worlds:
-			wbu.wave.get_world(w).mark_dead()
+			wave(ctx).get_world(w).mark_dead()
 		await ctx.message.add_reaction(REACT_CHECK)
 
 
-	# @client.command(name='wbs', brief='Show next wave information')
-	# async def wbs(ctx):
-	# 	""" Returns the time to and of next wave in several timezones. """
-	# 	await ctx.send(next_wave_info())
+	@client.command(name='board', brief='Show the world list at a past minute')
+	@commands.has_role(ROLE_HOST)
+	async def board(ctx, minute: int, waves_ago: int = 0):
+		"""
+		Shows the world list as it was at `minute` past the hour,
+		e.g. `.board 7` for what it looked like at :07.
+
+		Use `waves_ago` to look at a previous wave instead, e.g.
+		`.board 7 1` for the wave before this one.
+
+		This command is only available to hosts.
+		"""
+		history = wbu.shard_for(ctx.channel).get_history(waves_ago)
+		if not 0 <= minute < 60 or not history:
+			await ctx.send(f'Invalid minute or wave: {minute} {waves_ago}')
+			return
+
+		ref = datetime.now(timezone.utc)
+		if history.ended:
+			ref = datetime.fromtimestamp(history.ended, timezone.utc)
+		at = at_minute(minute, ref)
+
+		em = discord.Embed(title=f'Board at {at:%H:%M} UTC', color=0xeeeeee)
+		WbsWave.from_history(history, at).fill_worldlist_embed(em, WbsTime(at.minute, at.second))
+		await ctx.send(embed=em)
+
+
+	@client.command(name='timeline', brief='Show the history of a world')
+	@commands.has_role(ROLE_HOST)
+	async def timeline(ctx, world: int, waves_ago: int = 0):
+		"""
+		Lists every change made to `world` this wave, with the
+		time of the change.
+
+		Use `waves_ago` to look at a previous wave instead.
+
+		This command is only available to hosts.
+		"""
+		history = wbu.shard_for(ctx.channel).get_history(waves_ago)
+		if not history:
+			await ctx.send(f'Invalid wave: {waves_ago}')
+			return
+
+		events = history.timeline(world)
+		if not events:
+			await ctx.send(f'No changes to world {world}')
+			return
+		for e in events:
+			wbu.outbox.post(ctx.channel.id, describe_event(*e), coalesce=True)
+
+
+	@client.command(name='wbs', brief='Show next wave information')
+	async def wbs(ctx, which: str = ''):
+		"""
+		Returns the time to and of next wave in several timezones.
+
+		Use `.wbs week` to list every wave in the next 7 days instead.
+		"""
+		if which == 'week':
+			await ctx.send(week_schedule())
+		else:
+			await ctx.send(next_wave_info())
 
 
 	@client.command(name='take', brief='Assign yourself some worlds', aliases=['t'])
@@ -205,7 +318,7 @@ def register_commands(client: commands.Bot, wbu: WbuBot):
 		if numworlds < 1:
 			await ctx.send(f'Invalid numworlds: {numworlds}')
 
-		ret = wbu.wave.take_worlds(
+		ret = wave(ctx).take_worlds(
 			numworlds, parser.convert_location(location), ctx.author.id)
 
 		await ctx.send(ret, reference=ctx.message, mention_author=True)
@@ -226,7 +339,7 @@ def register_commands(client: commands.Bot, wbu: WbuBot):
 		may safely assume that they are dead and mark
 		the worlds as such.
 		"""
-		wbu.wave.mark_noinfo_dead_for_assignee(ctx.author.id)
+		wave(ctx).mark_noinfo_dead_for_assignee(ctx.author.id)
 		await take(ctx, numworlds, location)
 
 
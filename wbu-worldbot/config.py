@@ -1,7 +1,7 @@
 import os
 
 DEBUG = 'WORLDBOT_DEBUG' in os.environ
-VERSION = '4.0.4'
+VERSION = '4.1.0'
 
 GUILD_WBS_UNITED = 261802377009561600
 
@@ -14,6 +14,13 @@ CHANNEL_BOTSPAM = 318793375136481280
 
 RESPONSE_CHANNELS = [CHANNEL_HELP, CHANNEL_WAVE_CHAT, CHANNEL_BOTSPAM, CHANNEL_BOT_LOG]
 
+# Channels that scout a wave of their own instead of sharing the one in
+# RESPONSE_CHANNELS, e.g. for other FCs or a second scouting team.
+# Maps channel id -> guild id
+EXTRA_WAVE_CHANNELS = {}
+# Unload those waves after this long without messages, they're saved to disk
+SHARD_IDLE_SECS = 2*60*60
+
 ROLE_WBS_NOTIFY = 484721172815151114
 ROLE_HOST = 292206099833290752
 ROLE_TEXT_PERM = 880185096055976016
@@ -23,6 +30,35 @@ REACT_CROSS = '❌'
 
 DEFAULT_FC = 'Wbs United'
 
+# Edit one pinned `list` message in place instead of re-sending it, and at
+# most once every LIST_DEBOUNCE_SECS
+LIVE_LIST = True
+LIST_DEBOUNCE_SECS = 5
+
+# Instances that share STATE_DIR elect one of them to respond through a lease
+# in LEASE_PATH, renewed every LEASE_RENEW_SECS. The others stand by, following
+# the saved wave state, and take over once the lease is LEASE_TTL_SECS old
+STATE_DIR = os.environ.get('WORLDBOT_STATE_DIR', '.')
+LEASE_PATH = os.path.join(STATE_DIR, 'worldbot.lease')
+LEASE_TTL_SECS = 10
+LEASE_RENEW_SECS = 2
+
+# Wave state is saved to WAVE_STATE_PATH.snap and .wal so it survives restarts,
+# compacting the log into a new snapshot every WAVE_SNAPSHOT_EVERY changes
+WAVE_STATE_PATH = os.path.join(STATE_DIR, 'wavestate')
+WAVE_SNAPSHOT_EVERY = 500
+
+# Number of past waves whose world history is kept for `.board` and `.timeline`
+HISTORY_KEEP_WAVES = 50
+
+# Prometheus metrics are served at http://127.0.0.1:METRICS_PORT/metrics
+METRICS_PORT = int(os.environ.get('WORLDBOT_METRICS_PORT', 9464))
+
+# `.profile` samples the event loop every PROFILE_INTERVAL_SECS, for at most
+# PROFILE_MAX_SECS
+PROFILE_INTERVAL_SECS = 0.005
+PROFILE_MAX_SECS = 60
+
 P2P_WORLDS = [
     1,2,4,5,6,9,10,
     12,14,15,16,18,
@@ -56,6 +92,10 @@ HIDDEN_WORLDS = [
     118,
 ]
 
+# Set versions of the above for membership tests in hot paths
+P2P_WORLD_SET = frozenset(P2P_WORLDS)
+HIDDEN_WORLD_SET = frozenset(HIDDEN_WORLDS)
+
 GUIDE_STR = ["""
 **Worldbot instructions:**
 
@@ -68,7 +108,7 @@ For more help with regular commands, please use `.help <command>`. For example,
 General commands:
 - **.help** - show more detailed help for specific commands
 - **.version** - shows the current version of the bot
-- **.wbs** - shows the time of the next wave
+- **.wbs** - shows the time of the next wave, `.wbs week` for the week's schedule
 
 Wave management commands:
 - **.host [user]** - set user as host. Defaults to caller
@@ -78,10 +118,13 @@ Wave management commands:
 - **.fc <fcname>** - sets active fc or show fc in none provided
 - **.call <string>** - adds <string> to the call history.
 - **.clear <num>** - delete the previous <num> messages
+- **.board <minute> [waves ago]** - show the world list as it was at <minute> past the hour
+- **.timeline <world> [waves ago]** - list every change made to <world>
 
 Bot management commands (most only useable by bot owner):
 - **.debug** - show debug information
 - **.exit** - kill the bot
+- **.jobs** - show scheduled jobs (autoreset, wave reminder)
 - **.guide** - show this message
 """, """
 **Scouting commands** 
@@ -121,6 +164,8 @@ Further notes:
   means `10elmhcf7` is just as valid as `10 elm hcf 7`.
 - For all time inputs the colon and seconds part is optional. For example,
   both '7' and '7:15' are both perfectly valid times, but not '715'.
+- Multiple worlds can be updated in one message by putting each update on
+  its own line. If any line has an invalid world, none of them are applied.
 """, """
 **Misc**
 - There are a bunch of easter eggs if you know the old bot. Why don't you try some of them?
@@ -0,0 +1,111 @@
+"""
+Minimal stand-ins for the parts of the discord client the bot uses, for load
+testing and replaying messages without the network.
+
+Channels enforce a per-channel limit of `limit` messages per `window` secs
+the same way Discord does. Like discord.py, a send that hits the limit
+waits out the rest of the window and retries, and the hit is counted.
+"""
+
+import asyncio, itertools
+
+import discord
+
+
+class FakeResponse:
+    """ What discord.HTTPException wants to know about a failed request """
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+class FakeAuthor:
+    def __init__(self, display_name: str, id: int = 0, bot: bool = False):
+        self.display_name = display_name
+        self.id = id
+        self.bot = bot
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, channel: 'FakeChannel', content: str = None, embed=None,
+            author: FakeAuthor = None):
+        self.id = next(FakeMessage._ids)
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.author = author
+        self.pinned = False
+        self.deleted = False
+        self.reactions = []
+
+    async def edit(self, content=None, embed=None):
+        await self.channel.api_call()
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+        self.channel.edits += 1
+
+    async def pin(self):
+        await self.channel.api_call()
+        self.pinned = True
+
+    async def delete(self):
+        await self.channel.api_call()
+        self.deleted = True
+
+    async def add_reaction(self, emoji):
+        await self.channel.api_call()
+        self.reactions.append(emoji)
+
+
+class FakeChannel:
+    def __init__(self, id: int, latency: float = 0.05, limit: int = 5, window: float = 5.0):
+        self.id = id
+        self.latency = latency
+        self.limit = limit
+        self.window = window
+        self.sent = []
+        self.edits = 0
+        self.ratelimit_hits = 0
+        self._window_start = None
+        self._window_count = 0
+
+    async def api_call(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            now = loop.time()
+            if self._window_start is None or now - self._window_start >= self.window:
+                self._window_start, self._window_count = now, 0
+            if self._window_count < self.limit:
+                self._window_count += 1
+                break
+            self.ratelimit_hits += 1
+            await asyncio.sleep(self._window_start + self.window - now)
+        await asyncio.sleep(self.latency)
+
+    async def send(self, content: str = None, embed=None, **kwargs):
+        await self.api_call()
+        msg = FakeMessage(self, content, embed)
+        self.sent.append(msg)
+        return msg
+
+    async def fetch_message(self, id: int) -> FakeMessage:
+        await self.api_call()
+        for msg in self.sent:
+            if msg.id == id and not msg.deleted:
+                return msg
+        raise discord.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Message')
+
+
+class FakeClient:
+    def __init__(self, **channel_kwargs):
+        self.channel_kwargs = channel_kwargs
+        self.channels = dict()
+
+    def get_channel(self, id: int) -> FakeChannel:
+        if id not in self.channels:
+            self.channels[id] = FakeChannel(id, **self.channel_kwargs)
+        return self.channels[id]
@@ -0,0 +1,158 @@
+import bisect, time
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+# World fields tracked per event, in the order of the bits in an event's mask
+FIELDS = ('loc', 'state', 'tents', 'time', 'notes', 'assigned', 'suspicious')
+
+
+def at_minute(minute: int, ref: datetime):
+    """ Latest time at or before `ref` that is `minute` past the hour """
+    t = ref.replace(minute=minute, second=0, microsecond=0)
+    if t > ref:
+        t -= timedelta(hours=1)
+    return t
+
+
+class WorldHistory:
+    """
+    Append-only log of every change to the worlds in a wave, so the board
+    can be rebuilt as it was at any point in time.
+
+    Worlds are recorded as dicts in the format of `World.to_dict`. Each
+    event is a world's full state after a change, plus a mask of which
+    fields changed. Events are stored column-wise in typed arrays, with
+    strings and assignee ids interned, so an event costs a few dozen bytes
+    and many past waves can be kept around.
+
+    `initial` is the state every world starts in, which the first change to
+    each world is compared against.
+
+    Every `checkpoint_every` events the state of every changed world is
+    saved, so rebuilding the board at some time only replays the events
+    since the closest checkpoint before it.
+    """
+
+    def __init__(self, initial: dict, checkpoint_every: int = 256):
+        self.initial = initial
+        self.checkpoint_every = checkpoint_every
+        self.started = time.time()
+        # Set when the wave is reset and this history is archived
+        self.ended = None
+
+        self._ts = array('d')
+        self._nums = array('H')
+        self._masks = array('B')
+        self._locs = array('H')
+        self._states = array('H')
+        self._tents = array('I')
+        self._times = array('i')
+        self._notes = array('I')
+        self._assigned = array('I')
+        self._sus = array('B')
+
+        # Interned field values, index 0 is always None
+        self._values = [None]
+        self._value_idx = {None: 0}
+
+        # World num -> indexes of its events, for timelines
+        self._by_world: Dict[int, array] = dict()
+        # World num -> index of its latest event, and checkpoints of it
+        self._last: Dict[int, int] = dict()
+        self._cp_idx = array('I')
+        self._cp_states: List[Dict[int, int]] = []
+
+    def __len__(self):
+        return len(self._ts)
+
+    def _intern(self, v):
+        i = self._value_idx.get(v)
+        if i is None:
+            i = self._value_idx[v] = len(self._values)
+            self._values.append(v)
+        return i
+
+    def record(self, wd: dict, ts: float = None):
+        """ Appends the new state `wd` of a world, if anything changed """
+        num = wd['num']
+        last = self._last.get(num)
+        old = self.initial if last is None else self.event(last)[2]
+        mask = 0
+        for bit, f in enumerate(FIELDS):
+            if old[f] != wd[f]:
+                mask |= 1 << bit
+        if not mask:
+            return
+
+        i = len(self._ts)
+        self._ts.append(time.time() if ts is None else ts)
+        self._nums.append(num)
+        self._masks.append(mask)
+        self._locs.append(self._intern(wd['loc']))
+        self._states.append(self._intern(wd['state']))
+        self._tents.append(self._intern(wd['tents']))
+        self._times.append(-1 if wd['time'] is None else wd['time'])
+        self._notes.append(self._intern(wd['notes']))
+        self._assigned.append(self._intern(wd['assigned']))
+        self._sus.append(wd['suspicious'])
+        self._by_world.setdefault(num, array('I')).append(i)
+        self._last[num] = i
+
+        if len(self._ts) % self.checkpoint_every == 0:
+            self._cp_idx.append(len(self._ts))
+            self._cp_states.append(dict(self._last))
+
+    def event(self, i: int) -> Tuple[float, int, dict]:
+        """ Returns (time, mask of changed fields, world dict) of event `i` """
+        secs = self._times[i]
+        wd = {
+            'num': self._nums[i],
+            'loc': self._values[self._locs[i]],
+            'state': self._values[self._states[i]],
+            'tents': self._values[self._tents[i]],
+            'time': None if secs == -1 else secs,
+            'notes': self._values[self._notes[i]],
+            'assigned': self._values[self._assigned[i]],
+            'suspicious': bool(self._sus[i]),
+        }
+        return self._ts[i], self._masks[i], wd
+
+    def state_at(self, ts: float) -> Dict[int, dict]:
+        """ World num -> world dict of every world changed at or before `ts` """
+        end = bisect.bisect_right(self._ts, ts)
+        c = bisect.bisect_right(self._cp_idx, end) - 1
+        if c >= 0:
+            latest, start = dict(self._cp_states[c]), self._cp_idx[c]
+        else:
+            latest, start = dict(), 0
+        for i in range(start, end):
+            latest[self._nums[i]] = i
+        return {num: self.event(i)[2] for num, i in latest.items()}
+
+    def timeline(self, num: int) -> List[Tuple[float, int, dict]]:
+        return [self.event(i) for i in self._by_world.get(num, ())]
+
+    def nbytes(self):
+        """ Approximate memory used by the event columns """
+        cols = (self._ts, self._nums, self._masks, self._locs, self._states,
+            self._tents, self._times, self._notes, self._assigned, self._sus)
+        return sum(c.itemsize * len(c) for c in cols)
+
+
+def describe_event(ts: float, mask: int, wd: dict):
+    """ One line summary of what an event changed, for timelines """
+    changes = []
+    for bit, f in enumerate(FIELDS):
+        if not mask & (1 << bit):
+            continue
+        v = wd[f]
+        if f == 'time':
+            v = '__:__' if v is None else f'{v // 60}:{v % 60:02}'
+        elif f == 'assigned':
+            v = 'nobody' if v is None else f'<@{v}>'
+        elif f == 'suspicious':
+            v = 'yes' if v else 'no'
+        changes.append(f'{f} {v}')
+    tsstr = datetime.fromtimestamp(ts, timezone.utc).strftime('%H:%M:%S')
+    return f'{tsstr}: ' + ', '.join(changes)
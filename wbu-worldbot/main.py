@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 
+import os, sys
 import aiohttp, discord
 import discord.ext.commands as discordbot
+
+# Modules shared with the other bots live in the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
 import commands, wbubot
+from logsink import LogSink
 
 def main(token: str):
     # Set up discord client
@@ -12,8 +18,8 @@ def main(token: str):
     conn = aiohttp.TCPConnector(ssl=False)
     client = discordbot.Bot(connector=conn, command_prefix='.', intents=intents)
 
-    msglog = open('messages.log', 'a', encoding='utf-8')
-    botlog = open('bot.log', 'a', encoding='utf-8')
+    msglog = LogSink('messages.log')
+    botlog = LogSink('bot.log')
 
     bot = wbubot.WbuBot(client, msglog, botlog)
     commands.register_commands(client, bot)
@@ -0,0 +1,226 @@
+import asyncio, logging, math
+from typing import Dict, List, Tuple
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    """
+    Latency histogram with log-linear buckets, like HdrHistogram: every
+    power of two between `2**MIN_EXP` and `2**MAX_EXP` secs (about 1us to
+    2 minutes) is split into `SUB_BUCKETS` equal buckets, so the relative
+    error is bounded at any scale. Recording a value is one `frexp` and a
+    list increment.
+    """
+
+    SUB_BUCKETS = 4
+    MIN_EXP = -19
+    MAX_EXP = 7
+    NUM_BUCKETS = (MAX_EXP - MIN_EXP) * SUB_BUCKETS
+
+    def __init__(self):
+        # The extra last bucket holds anything too large
+        self.counts = [0] * (self.NUM_BUCKETS + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    @classmethod
+    def upper_bound(cls, i: int):
+        e, sub = divmod(i, cls.SUB_BUCKETS)
+        return (0.5 + (sub + 1) / (2 * cls.SUB_BUCKETS)) * 2.0 ** (e + cls.MIN_EXP)
+
+    def observe(self, secs: float):
+        self.count += 1
+        self.sum += secs
+        m, e = math.frexp(secs)
+        i = (e - self.MIN_EXP) * self.SUB_BUCKETS + int((m - 0.5) * 2 * self.SUB_BUCKETS)
+        if i < 0 or secs <= 0:
+            i = 0
+        elif i > self.NUM_BUCKETS:
+            i = self.NUM_BUCKETS
+        self.counts[i] += 1
+
+    def quantile(self, q: float):
+        """ Upper bound of the bucket the `q` quantile falls in """
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= target:
+                return self.upper_bound(i) if i < self.NUM_BUCKETS else math.inf
+        return 0.0
+
+
+INF_LABEL = 'le="+Inf"'
+
+
+def _labelstr(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = ''):
+    pairs = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Family:
+    """ A metric and its children, one per combination of label values """
+
+    def __init__(self, kind: str, name: str, doc: str, labels: List[str], factory):
+        self.kind = kind
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labels)
+        self.factory = factory
+        self.children: Dict[Tuple[str, ...], object] = dict()
+        if not labels:
+            self.children[()] = factory()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.factory()
+        return child
+
+    # Shortcuts for metrics without labels
+    def inc(self, n: int = 1):
+        self.children[()].inc(n)
+
+    def set(self, value: float):
+        self.children[()].set(value)
+
+    def observe(self, secs: float):
+        self.children[()].observe(secs)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+        for values, m in sorted(self.children.items()):
+            if self.kind != 'histogram':
+                lines.append(f'{self.name}{_labelstr(self.labelnames, values)} {m.value}')
+                continue
+
+            # Buckets up to the largest value seen, then +Inf
+            last = max((i for i, c in enumerate(m.counts[:-1]) if c), default=-1)
+            cumulative = 0
+            for i in range(last + 1):
+                cumulative += m.counts[i]
+                le = f'le="{Histogram.upper_bound(i):.6g}"'
+                lines.append(f'{self.name}_bucket{_labelstr(self.labelnames, values, le)} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labelstr(self.labelnames, values, INF_LABEL)} {m.count}')
+            lines.append(f'{self.name}_sum{_labelstr(self.labelnames, values)} {m.sum}')
+            lines.append(f'{self.name}_count{_labelstr(self.labelnames, values)} {m.count}')
+        return lines
+
+
+class Registry:
+    """
+    Every metric of a bot, rendered in the Prometheus text format by
+    `render`. Metrics are plain counters updated from the event loop, so
+    they cost a few hundred nanoseconds to update and need no locking.
+    """
+
+    def __init__(self):
+        self.families: Dict[str, Family] = dict()
+
+    def _add(self, kind, name, doc, labels, factory):
+        fam = self.families[name] = Family(kind, name, doc, labels or [], factory)
+        return fam
+
+    def counter(self, name: str, doc: str, labels: List[str] = None) -> Family:
+        return self._add('counter', name, doc, labels, Counter)
+
+    def gauge(self, name: str, doc: str, labels: List[str] = None) -> Family:
+        return self._add('gauge', name, doc, labels, Gauge)
+
+    def histogram(self, name: str, doc: str, labels: List[str] = None) -> Family:
+        return self._add('histogram', name, doc, labels, Histogram)
+
+    def render(self) -> str:
+        lines = []
+        for fam in self.families.values():
+            lines.extend(fam.render())
+        return '\n'.join(lines) + '\n'
+
+
+async def sample_loop_lag(hist: Family, gauge: Family, interval: float = 0.5):
+    """
+    Measures how late the event loop wakes up from a sleep of `interval`
+    secs, i.e. how long something blocked it, forever.
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        hist.observe(lag)
+        gauge.set(lag)
+
+
+class RateLimitCounter(logging.Handler):
+    """
+    Counts the rate limit warnings discord.py logs when Discord answers 429,
+    as it retries those itself without telling us.
+    """
+
+    def __init__(self, counter: Family):
+        super().__init__(logging.WARNING)
+        self.counter = counter
+
+    def emit(self, record: logging.LogRecord):
+        if 'rate limit' in record.getMessage().lower():
+            self.counter.inc()
+
+
+async def serve_metrics(registry: Registry, host: str = '127.0.0.1', port: int = 9464):
+    """ Serves `registry` at http://host:port/metrics from the running loop """
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+
+# Worldbot metrics
+# ================
+
+REGISTRY = Registry()
+
+ON_MESSAGE = REGISTRY.histogram('worldbot_on_message_seconds',
+    'Time to handle a message in WbuBot.on_message')
+PROCESS_MESSAGE = REGISTRY.histogram('worldbot_process_message_seconds',
+    'Time spent in parser.process_message, by message kind', ['kind'])
+COMMAND = REGISTRY.histogram('worldbot_command_seconds',
+    'Time to run a command, by command', ['command'])
+DISCORD_SEND = REGISTRY.histogram('worldbot_discord_send_seconds',
+    'Time to send or edit a message on discord, by what sent it', ['source'])
+LOOP_LAG = REGISTRY.histogram('worldbot_loop_lag_seconds',
+    'How late the event loop woke up from a sleep')
+LOOP_LAG_LAST = REGISTRY.gauge('worldbot_loop_lag_last_seconds',
+    'Latest event loop lag sample')
+
+UPDATES = REGISTRY.counter('worldbot_updates_parsed_total',
+    'World updates parsed from messages')
+ERRORS = REGISTRY.counter('worldbot_errors_total',
+    'Errors while handling messages and commands, by where', ['where'])
+RATELIMITS = REGISTRY.counter('worldbot_ratelimit_hits_total',
+    'Times discord answered with a rate limit')
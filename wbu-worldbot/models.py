@@ -1,10 +1,12 @@
-import functools, inspect, pprint
+import asyncio, bisect, functools, heapq, inspect, pprint, time, traceback
 from datetime import datetime
 from enum import Enum, auto
-from typing import List
+from typing import Dict, List, Set
 import discord
 
 from config import *
+from history import WorldHistory
+from metrics import DISCORD_SEND
 
 def debug(msg):
     if DEBUG:
@@ -51,6 +53,8 @@ class WbsTime():
     hopefully it won't happen anytime soon. Or ever.
     """
 
+    __slots__ = ('mins', 'secs')
+
     @staticmethod
     def current():
         t = datetime.utcnow().time()
@@ -77,6 +81,9 @@ class WbsTime():
             return self
         return WbsTime(self.mins + mins, self.secs)
 
+    def to_secs(self):
+        return self.mins*60 + self.secs
+
     def time_until(self, other: 'WbsTime'):
         a = self.mins*60 + self.secs
         b = other.mins*60 + other.secs
@@ -117,13 +124,25 @@ class World:
     world. The update should only set fields that will be updated, and when
     calling the `update_from` method it will search for all fields with
     a value and replace the value of itself with the new one.
+
+    Worlds that belong to a `WbsWave` keep a reference to it, and tell it
+    whenever their location, state, or assignee changes so the wave's
+    indexes stay up to date, and whenever anything changes so it can be
+    recorded.
+
+    Every parsed update command creates one of these, so it uses slots to
+    keep construction cheap and the objects small.
     """
 
-    def __init__(self, num:int, update:bool=False):
-        if not num in P2P_WORLDS:
+    __slots__ = ('num', 'wave', 'loc', 'state', 'tents', 'time', 'notes',
+        'assigned', 'suspicious')
+
+    def __init__(self, num:int, update:bool=False, wave:'WbsWave'=None):
+        if not num in P2P_WORLD_SET:
             raise InvalidWorldErr(num)
 
         self.num = num
+        self.wave = wave
         if update:
             self.loc = None
             self.state = None
@@ -146,23 +165,73 @@ class World:
         return self.loc == Location.UNKNOWN and self.state == WorldState.NOINFO \
             and self.tents == '' and self.time == None and self.notes == None
 
+    def index_key(self):
+        return self.loc, self.state, self.assigned
+
+    def reindex(self, oldkey):
+        if self.wave and oldkey != self.index_key():
+            self.wave.reindex_world(self, oldkey)
+
+    def is_modified(self):
+        """ True iff anything differs from a newly created world """
+        return self.loc != Location.UNKNOWN or self.state != WorldState.NOINFO \
+            or self.tents != '' or self.time != None or self.notes != None \
+            or self.assigned != None or self.suspicious
+
+    def record(self):
+        if self.wave:
+            self.wave.record_world(self)
+
+    def to_dict(self):
+        return {
+            'num': self.num,
+            'loc': self.loc.value,
+            'state': self.state.value,
+            'tents': self.tents,
+            'time': self.time.to_secs() if self.time else None,
+            'notes': self.notes,
+            'assigned': self.assigned,
+            'suspicious': self.suspicious,
+        }
+
+    def restore(self, d: dict):
+        """ Sets every field from `to_dict` output """
+        oldkey = self.index_key()
+        self.loc = Location(d['loc'])
+        self.state = WorldState(d['state'])
+        self.tents = d['tents']
+        self.time = WbsTime(0, d['time']) if d['time'] is not None else None
+        self.notes = d['notes']
+        self.assigned = d['assigned']
+        self.suspicious = d['suspicious']
+        self.reindex(oldkey)
+
     def mark_dead(self):
+        oldkey = self.index_key()
         self.state = WorldState.DEAD
+        self.reindex(oldkey)
+        self.record()
+
+    def assign(self, assignee: int):
+        oldkey = self.index_key()
+        self.assigned = assignee
+        self.reindex(oldkey)
+        self.record()
 
-    def get_remaining_time(self):
+    def get_remaining_time(self, now: WbsTime = None):
         if self.time == None:
             return -1
-        return WbsTime.current().time_until(self.time)
+        return (now or WbsTime.current()).time_until(self.time)
 
-    def get_line_summary(self):
+    def get_line_summary(self, now: WbsTime = None):
         tent_str = '   ' if not self.tents else self.tents
         notes_str = '' if self.notes == None else self.notes
-        timestr = '__:__' if self.time == None else str(self.get_remaining_time())
+        timestr = '__:__' if self.time == None else str(self.get_remaining_time(now))
         susstr = '*' if self.suspicious else ' '
         return f'{self.num:3} {self.loc}{susstr}: {timestr} {tent_str} {notes_str}'
 
-    def get_num_summary(self):
-        t = self.get_remaining_time()
+    def get_num_summary(self, now: WbsTime = None):
+        t = self.get_remaining_time(now)
         ret = ''
         if self.state == WorldState.BEAMING:
             ret = f'*{self.num}*'
@@ -181,7 +250,7 @@ class World:
         if not self.time:
             return
         if self.state == WorldState.ALIVE and curtime >= self.time:
-            self.state = WorldState.DEAD
+            self.mark_dead()
 
     def update_from(self, other: 'World'):
         """ 
@@ -189,6 +258,7 @@ class World:
         the other object it will set this.field as the new value. Returns
         true iff something actually got updated.
         """
+        oldkey = self.index_key()
         if other.loc:
             self.loc = other.loc
         if other.state:
@@ -201,11 +271,26 @@ class World:
             self.notes = other.notes
         if other.suspicious:
             self.suspicious = other.suspicious
+        self.reindex(oldkey)
 
-        return bool(other.loc or other.state or other.tents or other.time or other.notes or other.suspicious)
+        changed = bool(other.loc or other.state or other.tents or other.time or other.notes or other.suspicious)
+        if changed:
+            self.record()
+        return changed
 
     def is_visible(self):
-        return not self.num in HIDDEN_WORLDS
+        return not self.num in HIDDEN_WORLD_SET
+
+
+def sorted_add(lst: List[int], x: int):
+    i = bisect.bisect_left(lst, x)
+    if i == len(lst) or lst[i] != x:
+        lst.insert(i, x)
+
+def sorted_remove(lst: List[int], x: int):
+    i = bisect.bisect_left(lst, x)
+    if i < len(lst) and lst[i] == x:
+        del lst[i]
 
 
 class WbsWave:
@@ -217,15 +302,44 @@ class WbsWave:
         self.worldhist = list()
         self.participants = set()
 
-        # Previous `list` message object
-        # We keep this around so we can delete it whenever somebody
-        # calls `list` again to reduce spam
-        self.prevlistmsg = None
+        # `WaveStore` every change is recorded to, if any
+        self.store = None
+
+        # Output of the `list` command
+        self.listboard = ListBoard(self)
+
+        # Bumped on every change to the registry, so the list board can tell
+        # if anything changed since it last rendered
+        self.version = 0
 
         self._registry = dict()
 
+        # Secondary indexes, kept up to date by `reindex_world` as worlds
+        # change. The per-location lists are sorted by world number and only
+        # include visible worlds.
+        # - _active_by_loc: worlds that aren't dead
+        # - _free_by_loc: unassigned worlds with no info, for `take`
+        # - _by_state: every world, by state
+        # - _by_assignee: every assigned world, by assignee
+        self._active_by_loc: Dict[Location, List[int]] = {l: [] for l in Location}
+        self._free_by_loc: Dict[Location, List[int]] = {l: [] for l in Location}
+        self._by_state: Dict[WorldState, Set[int]] = {s: set() for s in WorldState}
+        self._by_assignee: Dict[int, Set[int]] = dict()
+
+        # Min-heap of (estimated death time in secs, world num) for worlds
+        # that are alive with a time. Entries are never removed when a world
+        # changes, instead they're checked against the world when popped.
+        self._expiry = []
+
         for num in P2P_WORLDS:
-            self._registry[num] = World(num)
+            w = World(num, wave=self)
+            self._registry[num] = w
+            self._index(w, w.index_key())
+
+        # Every change to the worlds, for looking at the board in the past.
+        # Worlds all start out the same, so any fresh one will do as the
+        # initial state
+        self.history = WorldHistory(World(P2P_WORLDS[0]).to_dict())
 
     def get_debug_info(self):
         return inspect.cleandoc(f"""
@@ -237,6 +351,97 @@ class WbsWave:
         Registry: {pprint.pformat(self._registry)}
         """)
 
+    # Persistence
+    # ===========
+
+    # Wave fields other than worlds that are saved, and whether they're sets
+    SAVED_FIELDS = {
+        'fcname': False,
+        'host': False,
+        'antilist': True,
+        'scoutlist': True,
+        'worldhist': False,
+        'participants': True,
+    }
+
+    def record(self, rec: dict):
+        if self.store:
+            self.store.append(self, rec)
+
+    def record_world(self, w: World):
+        wd = w.to_dict()
+        self.history.record(wd)
+        self.record({'op': 'world', 'world': wd})
+
+    def set_field(self, field: str, value):
+        """ Sets one of `SAVED_FIELDS` and records the change """
+        setattr(self, field, value)
+        if self.SAVED_FIELDS[field]:
+            value = sorted(value)
+        self.record({'op': 'set', 'field': field, 'value': value})
+
+    def add_to(self, field: str, item):
+        """ Adds `item` to one of the set or list `SAVED_FIELDS` """
+        coll = getattr(self, field)
+        if self.SAVED_FIELDS[field]:
+            coll.add(item)
+        else:
+            coll.append(item)
+        self.set_field(field, coll)
+
+    def to_dict(self):
+        d = {f: sorted(getattr(self, f)) if isset else getattr(self, f)
+            for f, isset in self.SAVED_FIELDS.items()}
+        # Only worlds that differ from a fresh one need saving
+        d['worlds'] = [w.to_dict() for w in self._registry.values() if w.is_modified()]
+        d['listboard'] = self.listboard.to_dict()
+        return d
+
+    def restore(self, d: dict, ts: float = None):
+        """
+        Restores the state saved by `to_dict` at time `ts`, without recording
+        it anywhere except the history.
+        """
+        for f, isset in self.SAVED_FIELDS.items():
+            setattr(self, f, set(d[f]) if isset else d[f])
+        for wd in d['worlds']:
+            self.restore_world(wd, ts)
+        self.listboard.restore(d.get('listboard'))
+
+    def restore_world(self, wd: dict, ts: float = None):
+        w = self._registry.get(wd['num'])
+        if w is None:
+            # No longer a valid world since the state was saved
+            return
+        w.restore(wd)
+        self._track_expiry(w)
+        self.history.record(w.to_dict(), ts)
+        self.version += 1
+
+    def apply_record(self, rec: dict):
+        """ Replays a record from `record`, without recording it again """
+        op = rec['op']
+        if op == 'world':
+            self.restore_world(rec['world'], rec.get('ts'))
+        elif op == 'set':
+            isset = self.SAVED_FIELDS[rec['field']]
+            setattr(self, rec['field'], set(rec['value']) if isset else rec['value'])
+        elif op == 'board':
+            self.listboard.restore(rec['board'])
+
+    @staticmethod
+    def from_history(history: WorldHistory, at: datetime):
+        """
+        A new wave with the worlds as they were at `at` according to
+        `history`, for showing the board in the past. Worlds that would have
+        died by then are marked dead.
+        """
+        wave = WbsWave()
+        for wd in history.state_at(at.timestamp()).values():
+            wave.restore_world(wd)
+        wave.update_world_states(WbsTime(at.minute, at.second))
+        return wave
+
     def is_ignoremode(self):
         return self.ignoremode
 
@@ -244,36 +449,108 @@ class WbsWave:
         return [w for w in self._registry if w]
 
     def get_world(self, num):
-        if num not in P2P_WORLDS:
+        w = self._registry.get(num)
+        if w is None:
             raise InvalidWorldErr(num)
-        return self._registry[num]
+        return w
 
     def get_worlds(self):
         return self._registry.values()
 
+    def _track_expiry(self, world: 'World'):
+        if world.time and world.state == WorldState.ALIVE:
+            heapq.heappush(self._expiry, (world.time.to_secs(), world.num))
+
     # Return true iff we actually update something
     def update_world(self, update):
         world = self.get_world(update.num)
-        return world.update_from(update)
+        changed = world.update_from(update)
+        self._track_expiry(world)
+        if changed:
+            self.version += 1
+        return changed
 
-    def get_active_for_loc(self, loc):
-        return ','.join([w.get_num_summary() for w in self.get_worlds()
-            if w.loc == loc and w.is_visible() and w.state != WorldState.DEAD])
+    def update_worlds(self, updates: List['World']):
+        """
+        Applies a batch of updates in order. Every world is looked up before
+        anything is changed, so an invalid world leaves the registry
+        untouched. Returns true iff any world was updated.
+        """
+        worlds = [self.get_world(u.num) for u in updates]
+        changed = False
+        for w, u in zip(worlds, updates):
+            changed = w.update_from(u) or changed
+            self._track_expiry(w)
+        if changed:
+            self.version += 1
+        return changed
+
+    # Indexing
+    # ========
+
+    def _index(self, w: World, key):
+        loc, state, assigned = key
+        self._by_state[state].add(w.num)
+        if assigned is not None:
+            self._by_assignee.setdefault(assigned, set()).add(w.num)
+        if w.is_visible():
+            if state != WorldState.DEAD:
+                sorted_add(self._active_by_loc[loc], w.num)
+            if state == WorldState.NOINFO and assigned is None:
+                sorted_add(self._free_by_loc[loc], w.num)
+
+    def _unindex(self, w: World, key):
+        loc, state, assigned = key
+        self._by_state[state].discard(w.num)
+        if assigned is not None:
+            self._by_assignee[assigned].discard(w.num)
+        if w.is_visible():
+            sorted_remove(self._active_by_loc[loc], w.num)
+            sorted_remove(self._free_by_loc[loc], w.num)
+
+    def reindex_world(self, w: World, oldkey):
+        """ Called by worlds after their location, state, or assignee change """
+        self.version += 1
+        self._unindex(w, oldkey)
+        self._index(w, w.index_key())
+
+    def check_indexes(self):
+        """
+        Rebuilds every index from scratch by scanning the registry and
+        raises an AssertionError if any incremental index disagrees.
+        """
+        worlds = self.get_worlds()
+        for loc in Location:
+            active = [w.num for w in worlds
+                if w.loc == loc and w.is_visible() and w.state != WorldState.DEAD]
+            free = [w.num for w in worlds
+                if w.loc == loc and w.is_visible() and w.state == WorldState.NOINFO
+                and w.assigned == None]
+            assert self._active_by_loc[loc] == active, f'active {loc}: {self._active_by_loc[loc]} != {active}'
+            assert self._free_by_loc[loc] == free, f'free {loc}: {self._free_by_loc[loc]} != {free}'
+        for state in WorldState:
+            nums = {w.num for w in worlds if w.state == state}
+            assert self._by_state[state] == nums, f'state {state}: {self._by_state[state]} != {nums}'
+        assignees = {w.assigned for w in worlds if w.assigned is not None}
+        for a in assignees | set(self._by_assignee):
+            nums = {w.num for w in worlds if w.assigned == a}
+            assert self._by_assignee.get(a, set()) == nums, f'assignee {a}: {self._by_assignee.get(a)} != {nums}'
+
+    def get_active_for_loc(self, loc, now: WbsTime = None):
+        return ','.join([self._registry[n].get_num_summary(now) for n in self._active_by_loc[loc]])
 
     # Summary output
-    def fill_worldlist_embed(self, embed: discord.Embed):
+    def fill_worldlist_embed(self, embed: discord.Embed, now: WbsTime = None):
         """ Returns a KV map for discord embeds """
-        worlds = self.get_worlds()
-
         # dead_str = ','.join([str(w.num) for w in worlds if w.state == WorldState.DEAD])
-        active_dwfs = self.get_active_for_loc(Location.DWF)
-        active_elms = self.get_active_for_loc(Location.ELM)
-        active_rdis = self.get_active_for_loc(Location.RDI)
-        active_unks = self.get_active_for_loc(Location.UNKNOWN)
+        active_dwfs = self.get_active_for_loc(Location.DWF, now)
+        active_elms = self.get_active_for_loc(Location.ELM, now)
+        active_rdis = self.get_active_for_loc(Location.RDI, now)
+        active_unks = self.get_active_for_loc(Location.UNKNOWN, now)
 
-        all_active = [w for w in worlds if w.state == WorldState.ALIVE]
+        all_active = [self._registry[n] for n in sorted(self._by_state[WorldState.ALIVE])]
         all_active = sorted(all_active, key=lambda w: w.time, reverse=True)
-        all_active_str = '\n'.join([w.get_line_summary() for w in all_active])
+        all_active_str = '\n'.join([w.get_line_summary(now) for w in all_active])
 
         if active_dwfs:
             embed.add_field(name='DWF', value=active_dwfs, inline=False)
@@ -306,33 +583,194 @@ class WbsWave:
     def is_registry_empty(self):
         return not any(w for w in self._registry.values())
 
-    def update_world_states(self):
-        curtime = WbsTime.current()
-        for w in self.get_worlds():
+    def update_world_states(self, curtime: WbsTime = None):
+        """
+        Marks alive worlds whose estimated death time has passed as dead.
+        Only due entries are popped off the expiry heap, so this costs time
+        proportional to the number of expirations, not the registry size.
+        Returns the list of worlds that died.
+        """
+        curtime = curtime or WbsTime.current()
+        cursecs = curtime.to_secs()
+        expired = []
+        while self._expiry and self._expiry[0][0] <= cursecs:
+            secs, num = heapq.heappop(self._expiry)
+            w = self._registry[num]
+            # Stale entry, the world has been updated since it was pushed
+            if w.state != WorldState.ALIVE or not w.time or w.time.to_secs() != secs:
+                continue
             w.update_state(curtime)
+            expired.append(w)
+        return expired
 
     def add_participant(self, display_name):
-        self.participants.add(display_name)
+        self.add_to('participants', display_name)
 
     def mark_noinfo_dead_for_assignee(self, authorid: int):
-        worlds = [w for w in self.get_worlds() if w.assigned == authorid and w.state == WorldState.NOINFO]
-        for w in worlds:
-            w.mark_dead()
-        pass
+        nums = self._by_assignee.get(authorid, set()) & self._by_state[WorldState.NOINFO]
+        for n in nums:
+            self._registry[n].mark_dead()
 
     def take_worlds(self, numworlds: int, loc: str, authorid: int):
-        worlds = [w for w in self.get_worlds() 
-            if w.loc == loc 
-            and w.state == WorldState.NOINFO
-            and w.assigned == None
-            and w.is_visible()]
-
-        assigning = worlds[:numworlds]
+        assigning = [self._registry[n] for n in self._free_by_loc[loc][:numworlds]]
         for w in assigning:
-            w.assigned = authorid
+            w.assign(authorid)
 
         ret = ', '.join([str(w.num) for w in assigning])
         if len(assigning) < numworlds:
             ret += '. No more worlds available.'
 
         return ret
+
+
+class ListBoard:
+    """
+    The world list embed shown by the `list` command.
+
+    In live mode (`LIVE_LIST`) one pinned message is kept and edited in place
+    instead of being deleted and re-sent on every `list`. Edits are skipped
+    when nothing visible changed, and bursts of `list` calls are coalesced
+    into at most one edit every `LIST_DEBOUNCE_SECS`.
+
+    Otherwise the previous message is deleted and a new one sent every time.
+
+    Where the message is gets saved with the wave, so after a restart,
+    takeover or rebuild from the saved state the same message is fetched
+    and used again instead of leaving a stale board pinned.
+    """
+
+    def __init__(self, wave: WbsWave):
+        self.wave = wave
+        self.msg = None
+        self.fields = None
+        self.rendered_key = None
+        self.last_edit = 0.0
+        self.pending = None
+        # Channel and message id of the board from the saved state, until
+        # `msg` is fetched from them
+        self.saved = None
+
+    def to_dict(self):
+        if self.msg:
+            return {'channel': self.msg.channel.id, 'msg': self.msg.id}
+        return self.saved
+
+    def restore(self, d: dict):
+        self.saved = d
+
+    def record(self):
+        self.saved = None
+        self.wave.record({'op': 'board', 'board': self.to_dict()})
+
+    async def fetch_saved(self, channel):
+        """ Picks up the saved board, if it's still there """
+        saved, self.saved = self.saved, None
+        if saved['channel'] != channel.id:
+            guild = getattr(channel, 'guild', None)
+            channel = guild and guild.get_channel(saved['channel'])
+            if not channel:
+                return
+        try:
+            self.msg = await channel.fetch_message(saved['msg'])
+        except discord.HTTPException:
+            # Deleted, or we can't see it anymore
+            pass
+
+    async def show(self, channel):
+        if not self.msg and self.saved:
+            await self.fetch_saved(channel)
+
+        if not LIVE_LIST:
+            await self.resend(channel)
+            return
+
+        # An edit is already scheduled, it will pick up these changes too
+        if self.pending:
+            return
+
+        wait = self.last_edit + LIST_DEBOUNCE_SECS - time.monotonic()
+        if wait > 0:
+            self.pending = asyncio.ensure_future(self.render_later(channel, wait))
+        else:
+            await self.render(channel)
+
+    async def render_later(self, channel, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            await self.render(channel)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.pending = None
+
+    def build_embed(self):
+        self.wave.update_world_states()
+        em = discord.Embed(color=0xeeeeee)
+        self.wave.fill_worldlist_embed(em)
+        return em
+
+    async def render(self, channel):
+        # The list shows remaining times, so it can change even if the
+        # registry hasn't. Only skip rendering entirely within the same second
+        key = (self.wave.version, WbsTime.current())
+        if self.msg and self.msg.channel.id == channel.id and key == self.rendered_key:
+            return
+
+        em = self.build_embed()
+        fields = em.to_dict().get('fields')
+
+        if self.msg and self.msg.channel.id != channel.id:
+            await self.delete()
+
+        start = time.perf_counter()
+        if self.msg:
+            if fields == self.fields:
+                self.rendered_key = key
+                return
+            try:
+                await self.msg.edit(embed=em)
+            except discord.NotFound:
+                # Somebody deleted the board, send a new one
+                self.msg = None
+
+        if not self.msg:
+            self.msg = await channel.send(embed=em)
+            self.record()
+            try:
+                await self.msg.pin()
+            except discord.HTTPException as e:
+                # Pinning is only a convenience, e.g. the channel may be full
+                print(f'[LOG] Could not pin the list board: {e}')
+        DISCORD_SEND.labels('list').observe(time.perf_counter() - start)
+
+        # Only now, so a failed edit is retried by the next `list`
+        self.fields = fields
+        self.rendered_key = key
+        self.last_edit = time.monotonic()
+
+    def move_to(self, wave: WbsWave):
+        """
+        Shows `wave` from now on, in the same message. Used when the wave is
+        reset, so every wave doesn't leave another pinned board behind.
+        """
+        self.wave = wave
+        wave.listboard = self
+        self.rendered_key = None
+
+    async def resend(self, channel):
+        await self.delete()
+        self.msg = await channel.send(embed=self.build_embed())
+        self.record()
+
+    async def delete(self):
+        # Not reentrant but idc
+        if self.msg:
+            try:
+                await self.msg.delete()
+            except Exception:
+                # Just ignore it if the message is somehow missing
+                # That's what we wanted anyways
+                pass
+            self.msg = None
+            self.record()
+        self.fields = None
@@ -0,0 +1,219 @@
+import asyncio, time, traceback
+from collections import deque
+
+import discord
+
+from metrics import DISCORD_SEND
+from models import debug
+
+# Discord allows 5 messages per 5 seconds per channel
+CHANNEL_BURST = 5
+CHANNEL_RATE = 1.0
+MAX_MSG_LEN = 2000
+# Times a message is retried after Discord says we're rate limited, and how
+# long to wait if it doesn't say
+MAX_RETRIES = 3
+DEFAULT_RETRY_AFTER = 5.0
+
+
+def split_message(msg: str, limit: int = MAX_MSG_LEN):
+    """
+    Splits `msg` into pieces of at most `limit` chars, at the last newline
+    that fits if there is one
+    """
+    parts = []
+    while len(msg) > limit:
+        cut = msg.rfind('\n', 0, limit + 1)
+        if cut <= 0:
+            parts.append(msg[:limit])
+            msg = msg[limit:]
+        else:
+            parts.append(msg[:cut])
+            msg = msg[cut + 1:]
+    parts.append(msg)
+    return parts
+
+
+def retry_after(e: Exception):
+    """ Secs Discord asked us to wait if `e` is a rate limit, otherwise None """
+    if isinstance(e, discord.RateLimited):
+        return e.retry_after
+    if isinstance(e, discord.HTTPException) and e.status == 429:
+        headers = getattr(e.response, 'headers', None) or {}
+        try:
+            return float(headers.get('Retry-After', DEFAULT_RETRY_AFTER))
+        except ValueError:
+            return DEFAULT_RETRY_AFTER
+    return None
+
+
+class TokenBucket:
+    """
+    Allows bursts of up to `capacity` actions, refilling at `rate` tokens
+    per second.
+    """
+
+    def __init__(self, capacity: int, rate: float, clock):
+        self.capacity = capacity
+        self.rate = rate
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, secs: float):
+        """ Take no tokens for the next `secs` """
+        self._refill()
+        self.tokens = min(self.tokens, 1) - secs * self.rate
+
+    def delay(self):
+        """ Seconds until a token is available, 0 if one is available now """
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class ChannelQueue:
+    def __init__(self, channel_id: int, clock):
+        self.channel_id = channel_id
+        self.pending = deque()
+        self.bucket = TokenBucket(CHANNEL_BURST, CHANNEL_RATE, clock)
+        self.worker = None
+
+
+class Outbox:
+    """
+    Central dispatcher for messages the bot sends on its own (logs, notices,
+    notifications). Each channel has its own queue and worker task, paced by
+    a token bucket so that bursts don't run into Discord's rate limits.
+
+    Messages posted with `coalesce=True` are merged with consecutive
+    coalescable messages to the same channel, up to the 2000 char limit, so
+    a burst of log lines goes out as a few messages instead of dozens.
+    Messages over the limit are split into several.
+
+    Discord.py already waits out most rate limits itself. When it gives up
+    and raises one to us anyway, e.g. because our token bucket and Discord
+    disagree after a restart, the channel is paused for as long as Discord
+    asked and the message is sent again, up to `MAX_RETRIES` times.
+
+    `post` is fire-and-forget and returns a future for the sent message,
+    the last one if it had to be split, `send` waits for it.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.queues = dict()
+
+    def _clock(self):
+        return asyncio.get_event_loop().time()
+
+    def post(self, channel_id: int, msg: str, coalesce: bool = False) -> asyncio.Future:
+        q = self.queues.get(channel_id)
+        if not q:
+            q = self.queues[channel_id] = ChannelQueue(channel_id, self._clock)
+
+        futs = []
+        for part in split_message(msg):
+            fut = asyncio.get_event_loop().create_future()
+            # Don't complain about errors nobody asked to hear about, the
+            # worker already logs them
+            fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+            q.pending.append((part, coalesce, fut))
+            futs.append(fut)
+        if not q.worker:
+            q.worker = asyncio.ensure_future(self._drain(q))
+        if len(futs) == 1:
+            return futs[0]
+        return self._chain(futs)
+
+    def _chain(self, futs):
+        """
+        Future for the last of `futs`, or the first error. The parts are sent
+        in order, so once the last is done so are the rest.
+        """
+        fut = asyncio.get_event_loop().create_future()
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        def done(f):
+            if fut.done() or f.cancelled():
+                return
+            if f.exception():
+                fut.set_exception(f.exception())
+            elif f is futs[-1]:
+                fut.set_result(f.result())
+        for f in futs:
+            f.add_done_callback(done)
+        return fut
+
+    async def send(self, channel_id: int, msg: str, coalesce: bool = False):
+        return await self.post(channel_id, msg, coalesce)
+
+    def _next_batch(self, q: ChannelQueue):
+        msg, coalesce, fut = q.pending.popleft()
+        futs = [fut]
+        if not coalesce:
+            return msg, futs
+
+        while q.pending:
+            nmsg, ncoalesce, nfut = q.pending[0]
+            if not ncoalesce or len(msg) + 1 + len(nmsg) > MAX_MSG_LEN:
+                break
+            q.pending.popleft()
+            msg += '\n' + nmsg
+            futs.append(nfut)
+        return msg, futs
+
+    async def _drain(self, q: ChannelQueue):
+        try:
+            while q.pending:
+                delay = q.bucket.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                q.bucket.take()
+
+                msg, futs = self._next_batch(q)
+                debug(f'Outbox sending {len(futs)} message(s) to {q.channel_id}')
+                try:
+                    sent = await self._send(q, msg)
+                except Exception as e:
+                    traceback.print_exc()
+                    for f in futs:
+                        if not f.done():
+                            f.set_exception(e)
+                    continue
+
+                for f in futs:
+                    if not f.done():
+                        f.set_result(sent)
+        finally:
+            q.worker = None
+
+    async def _send(self, q: ChannelQueue, msg: str):
+        """ Sends `msg`, retrying it when rate limited """
+        retries = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                return await self.client.get_channel(q.channel_id).send(msg)
+            except Exception as e:
+                wait = retry_after(e)
+                if wait is None or retries >= MAX_RETRIES:
+                    raise
+            finally:
+                DISCORD_SEND.labels('outbox').observe(time.perf_counter() - start)
+
+            retries += 1
+            print(f'[LOG] Rate limited sending to {q.channel_id}, retrying in {wait:.1f}s')
+            q.bucket.pause(wait)
+            await asyncio.sleep(q.bucket.delay())
+            q.bucket.take()
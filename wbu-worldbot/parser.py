@@ -1,7 +1,9 @@
-import re, traceback, random
+import re, time, traceback, random
 from typing import Tuple
 import discord
 from models import *
+from classify import MessageClassifier, MsgKind
+from metrics import ERRORS, PROCESS_MESSAGE, UPDATES
 
 NUM_PAT = re.compile(r'^(\d+)')
 RANGE_PAT = re.compile(r'^(\d+)-(\d+)')
@@ -48,23 +50,38 @@ def convert_location(tok):
         return Location.DWF
     return Location.UNKNOWN
 
-def can_consume(s: str, *toks):
-    for t in toks:
-        if s.startswith(t):
-            return True
-    return False
-
-def consume(s: str, *toks):
-    for t in toks:
-        if s.startswith(t):
-            return s[len(t):].lstrip(' :')
-    return s
-    
+# Master tokenizer for update commands. Each alternative is one token type,
+# listed in the same priority order as the old prefix checks so that
+# ambiguous prefixes (eg 'minigames' vs 'mini', 'beaming' vs 'beamed') resolve the
+# same way. Trailing spaces and colons are eaten as part of the token, except
+# for tents which never had them stripped.
+SEP = r'[ :]*'
+UPDATE_TOK_PAT = re.compile(r'\s*(?:' + '|'.join([
+    r'(?P<sus>(?:mg|minigames|mini|sus|\*)' + SEP + ')',
+    r'(?P<dead>dead' + SEP + ')',
+    r'(?P<dies>dies' + SEP + r'(?:(?P<dies_min>\d+)' + SEP + ')?)',
+    r'(?P<beaming>beaming' + SEP + ')',
+    r'(?P<tents>[mhcsf]{3})',
+    r'(?P<loc>(?P<loc_name>dwf|elm|rdi|unk)' + SEP + ')',
+    r'(?P<beamed>beamed' + SEP + r'(?:(?P<beamed_min>\d+)' + SEP + ')?)',
+    r'(?P<broken>(?:broken|broke)' + SEP + r'(?:(?P<broken_min>\d+)' + SEP + ')?)',
+    r'(?P<time>(?P<time_mins>[0-9]\d*)' + SEP + r'(?:(?P<time_secs>\d+)' + SEP + ')?'
+        r'(?:(?P<time_unit>mins|gc)' + SEP + ')?)',
+    r'(?P<notes>.+)',
+]) + ')', re.DOTALL)
+
+def group_int(m, name):
+    g = m.group(name)
+    return int(g) if g else None
+
 
 def parse_update_command(msg: str):
     """
     Converts a message into a world update command. If the string is not
     an update command return null, otherwise return the world update object.
+
+    The message is tokenized in a single pass with `UPDATE_TOK_PAT`, each
+    match yielding one token whose type is the name of the outermost group.
     """
     msg = msg.strip().lower()
 
@@ -76,86 +93,62 @@ def parse_update_command(msg: str):
     # Build the world update object
     update = World(world_num, update=True)
 
-    cmd = msg
     time_found = False
-    debug(f'Parsing: {cmd}')
-    while cmd:
-        debug(f'Remaining: "{cmd}"')
-        # Ignore whitespace between tokens
-        cmd = cmd.lstrip()
-        # print(cmd)
-
-        if can_consume(cmd, 'mg', 'minigames', 'mini', 'sus', '*'):
-            cmd = consume(cmd, 'mg', 'minigames', 'mini', 'sus', '*')
+    pos, end = 0, len(msg)
+    while pos < end:
+        m = UPDATE_TOK_PAT.match(msg, pos)
+        if not m:
+            break
+        tok = m.lastgroup
+        pos = m.end()
+
+        if tok == 'sus':
             update.suspicious = True
-            continue
 
-        elif can_consume(cmd, 'dead'):
-            cmd = consume(cmd, 'dead')
+        elif tok == 'dead':
             update.state = WorldState.DEAD
-            continue
 
         # Syntax: 'dies :05'
-        elif can_consume(cmd, 'dies'):
-            cmd = consume(cmd, 'dies')
-            num, cmd = get_beg_number(cmd)
+        elif tok == 'dies':
+            num = group_int(m, 'dies_min')
             if not num:
                 continue
-
-            update.time = WbsTime(int(num), 0)
+            update.time = WbsTime(num, 0)
             update.state = WorldState.ALIVE
-            continue
 
-        elif cmd.startswith('beaming'):
+        elif tok == 'beaming':
             update.state = WorldState.BEAMING
-            cmd = consume(cmd, 'beaming')
-            continue
 
-        elif is_tents(cmd[0:3]):
-            update.tents = cmd[0:3]
-            cmd = cmd[3:]
-            continue
+        elif tok == 'tents':
+            update.tents = m.group('tents')
 
-        elif is_location(cmd[0:3]):
-            update.loc = convert_location(cmd[0:3])
-            cmd = consume(cmd, 'elm', 'rdi', 'dwf', 'unk')
-            continue
+        elif tok == 'loc':
+            update.loc = convert_location(m.group('loc_name'))
 
         # Syntax: 'beamed :02', space, colon, and time all optional
-        elif cmd.startswith('beamed'):
-            cmd = consume(cmd, 'beamed')
-            num, cmd = get_beg_number(cmd)
-
+        elif tok == 'beamed':
+            num = group_int(m, 'beamed_min')
             update.time = WbsTime.get_abs_minute_or_cur(num).add_mins(10)
             update.state = WorldState.ALIVE
             time_found = True
-            continue
 
         # Syntax: 'broken :02', same syntax as beamed
-        elif can_consume(cmd, 'broken', 'broke'):
-            cmd = consume(cmd, 'broken', 'broke')
-            num, cmd = get_beg_number(cmd)
-
+        elif tok == 'broken':
+            num = group_int(m, 'broken_min')
             update.time = WbsTime.get_abs_minute_or_cur(num).add_mins(5)
             update.state = WorldState.ALIVE
             time_found = True
-            continue
 
         # Syntax: 'xx:xx gc', the seconds and gc part optional
         # Uses gameclock by default. To override use 'mins' postfix
-        # Don't use isnumeric because it accepts wierd unicode codepoints
         # We only want to parse the time once, so if a scout includes
         # numbers in their comments about a world we don't re-parse
         # that as the new time
-        elif cmd[0] in '0123456789' and not time_found:
-            mins, cmd = get_beg_number(cmd)
-            secs, cmd = get_beg_number(cmd)
-            secs = secs if secs else 0
-
-            if cmd.startswith('mins'):
-                cmd = consume(cmd, 'mins')
-            else:
-                cmd = consume(cmd, 'gc')
+        elif tok == 'time' and not time_found:
+            mins = int(m.group('time_mins'))
+            secs = group_int(m, 'time_secs') or 0
+
+            if m.group('time_unit') != 'mins':
                 ticks = mins*60 + secs
                 total_secs = ticks*0.6
                 mins, secs = divmod(total_secs, 60)
@@ -163,16 +156,44 @@ def parse_update_command(msg: str):
             update.time = WbsTime.current().add(WbsTime(int(mins), int(secs)))
             update.state = WorldState.ALIVE
             time_found = True
-            continue
 
         # Everything after first unrecognised token are notes
         else:
-            update.notes = cmd
+            update.notes = msg[m.start(tok):]
             break
 
     return update
 
 
+def parse_update_lines(msg: str):
+    """
+    Splits a message into one update per line that starts with a number.
+    Lines that don't start with a number are added as they are to the notes
+    of the update before them, so multi-line notes still work. Raises
+    InvalidWorldErr if any line's number isn't a world, so a typo rejects
+    the whole message instead of being lost. Returns the list of world
+    update objects, which is empty if the message has no update commands.
+    """
+    updates = []
+    update = None
+    for line in msg.strip().splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] in '0123456789':
+            update = parse_update_command(line)
+            if update:
+                updates.append(update)
+        elif update:
+            line = line.lower()
+            update.notes = f'{update.notes}\n{line}' if update.notes else line
+    return updates
+
+
+# Built once, easter eggs can't change without a restart anyways
+CLASSIFIER = MessageClassifier(EASTER_EGGS)
+
+
 class ParserResp(Enum):
     RESPOND = auto()
     CONTINUE_TO_COMMAND = auto()
@@ -189,59 +210,58 @@ class ParserResp(Enum):
 
 
 async def process_message(wave: WbsWave, msgobj: discord.Message) -> Tuple[ParserResp, str]:
+    start = time.perf_counter()
+    kind = None
     try:
         cmd = msgobj.content.strip().lower()
+        kind, egg = CLASSIFIER.classify(cmd)
 
-        if cmd == 'list':
+        if kind == MsgKind.LIST:
             """
             The `list` command does the following:
             - Update world times
-            - Delete the output of the previoust `list` command
-            - Output the world state summary
+            - Show the world state summary, either by editing the live list
+              or by deleting the previous output and sending a new one
             - Delete the invocation of `list` itself
             """
-            wave.update_world_states()
-
-            # Not reentrant but idc
-            if wave.prevlistmsg:
-                try:
-                    await wave.prevlistmsg.delete()
-                except Exception as e:
-                    # Just ignore it if the message is somehow missing
-                    # That's what we wanted anyways
-                    pass
-            
-            em = discord.Embed(color=0xeeeeee)
-            wave.fill_worldlist_embed(em)
-            msg = await msgobj.channel.send(embed=em)
-            wave.prevlistmsg = msg
-
+            await wave.listboard.show(msgobj.channel)
             await msgobj.delete()
             return ParserResp.discard()
 
-        elif 'fc' in cmd and '?' in cmd:
+        elif kind == MsgKind.FC_QUERY:
             return ParserResp.respond(f'Using FC: "{wave.fcname}"')
 
         # Implement original worldbot commands
-        elif 'cpkwinsagain' in cmd:
+        elif kind == MsgKind.CPK:
             return ParserResp.respond(msgobj.author.display_name + ' you should STFU!')
 
-        elif cmd[0] in '0123456789':
-            update = parse_update_command(msgobj.content)
-            debug(f'Found update command, got "{update}"')
-            wave.update_world(update)
+        elif kind == MsgKind.UPDATE:
+            # Scouts often paste several updates in one message. Parse all of
+            # them before touching the wave so a bad world number in any line
+            # rejects the whole batch
+            updates = parse_update_lines(msgobj.content)
+            debug(f'Found update commands, got "{updates}"')
+            wave.update_worlds(updates)
+            UPDATES.inc(len(updates))
+
+            # Acknowledge batches with a single reaction instead of a reply
+            if len(updates) > 1:
+                await msgobj.add_reaction(REACT_CHECK)
             return ParserResp.discard()
 
-        else:
-            for k,v in EASTER_EGGS.items():
-                if k in cmd:
-                    return ParserResp.respond(v)
-        
+        elif kind == MsgKind.EASTER_EGG:
+            return ParserResp.respond(egg)
+
         return ParserResp.continue_to_command()
 
     except InvalidWorldErr as e:
         return ParserResp.respond(str(e))
 
     except Exception as e:
+        ERRORS.labels('parser').inc()
         traceback.print_exc()
-        return ParserResp.respond(f'ERROR: {str(e)}\n{traceback.format_exc()}')
\ No newline at end of file
+        return ParserResp.respond(f'ERROR: {str(e)}\n{traceback.format_exc()}')
+
+    finally:
+        label = kind.name.lower() if kind else 'unknown'
+        PROCESS_MESSAGE.labels(label).observe(time.perf_counter() - start)
\ No newline at end of file
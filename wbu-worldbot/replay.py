@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Replays a recorded message stream through the wave pipeline offline.
+
+Every message is fed through `parser.process_message` against a fresh
+`WbsWave`, using fake Discord channels and a virtual clock that drives
+`WbsTime.current()`, so a real wave can be benchmarked without a guild.
+Prints throughput, per-message latency percentiles, and the final state of
+every world that has information.
+
+Accepts the JSONL `messages.log` written by `WbuBot`, where the clock
+follows each record's timestamp, as well as the older `name: content` text
+format, where the clock starts at :00 and advances `--step` secs per line.
+
+`list` debouncing is disabled so every `list` is rendered, which gives the
+worst case. Commands (messages starting with `.`) are counted but not run.
+
+Usage: ./replay.py <messages.log> [--step SECS] [--repeat N]
+"""
+
+import argparse, asyncio, json, time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import models, parser
+from models import *
+from fakediscord import FakeAuthor, FakeChannel, FakeMessage
+
+
+class VirtualClock:
+    def __init__(self, start: datetime):
+        self.now = start
+
+    def wbstime(self):
+        return WbsTime(self.now.minute, self.now.second)
+
+
+def load_messages(path: str, step: float):
+    """ Returns a list of (datetime, author, content) """
+    msgs = []
+    start = datetime(2000, 1, 1)
+    with open(path, encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            line = line.rstrip('\n')
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                rec = None
+
+            if isinstance(rec, dict):
+                if 'content' not in rec:
+                    continue
+                ts = datetime.fromisoformat(rec['ts']).replace(tzinfo=None)
+                msgs.append((ts, rec.get('author', ''), rec['content']))
+            elif ': ' in line:
+                author, content = line.split(': ', 1)
+                msgs.append((start + timedelta(seconds=i*step), author, content))
+    return msgs
+
+
+async def replay(msgs):
+    clock = VirtualClock(msgs[0][0] if msgs else datetime(2000, 1, 1))
+    WbsTime.current = staticmethod(clock.wbstime)
+    models.LIST_DEBOUNCE_SECS = 0
+
+    wave = WbsWave()
+    channel = FakeChannel(CHANNEL_WAVE_CHAT, latency=0, limit=10**9)
+    authors = dict()
+    responses = Counter()
+    latencies = []
+
+    for ts, author, content in msgs:
+        if not content:
+            continue
+        clock.now = ts
+        if author not in authors:
+            authors[author] = FakeAuthor(author, id=len(authors) + 1)
+        msgobj = FakeMessage(channel, content=content, author=authors[author])
+
+        start = time.perf_counter()
+        rtype, _ = await parser.process_message(wave, msgobj)
+        latencies.append(time.perf_counter() - start)
+        responses[rtype.name] += 1
+
+    return wave, channel, responses, latencies
+
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * p))]
+
+
+def report(wave, channel, responses, latencies, elapsed):
+    lat = sorted(latencies)
+    print(f'Messages:    {len(lat)}')
+    print(f'Throughput:  {len(lat) / elapsed:,.0f} msgs/sec')
+    print(f'Latency p50: {percentile(lat, 0.50)*1e6:,.1f} us')
+    print(f'Latency p99: {percentile(lat, 0.99)*1e6:,.1f} us')
+    print(f'Latency max: {(lat[-1] if lat else 0)*1e6:,.1f} us')
+    print(f'Responses:   {dict(responses)}')
+    print(f'Sends:       {len(channel.sent)}, edits: {channel.edits}')
+
+    states = Counter(w.state for w in wave.get_worlds())
+    print('World states: ' + ', '.join(f'{s}={n}' for s, n in states.items()))
+    for w in wave.get_worlds():
+        if w.state != WorldState.NOINFO:
+            print(f'  {w.state!s:8} {w.get_line_summary()}')
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Replay a message log through the wave pipeline')
+    ap.add_argument('log')
+    ap.add_argument('--step', type=float, default=2.0,
+        help='secs between messages for logs without timestamps')
+    ap.add_argument('--repeat', type=int, default=1,
+        help='replay the log this many times back to back')
+    args = ap.parse_args()
+
+    msgs = load_messages(args.log, args.step) * args.repeat
+    start = time.perf_counter()
+    wave, channel, responses, latencies = asyncio.run(replay(msgs))
+    report(wave, channel, responses, latencies, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
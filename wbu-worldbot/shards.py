@@ -0,0 +1,180 @@
+import asyncio, time
+from collections import deque
+from typing import Dict, Tuple
+
+from config import *
+from models import *
+from wavestore import WaveStore
+
+# (guild id, channel id) of the channel a wave is scouted in
+ShardKey = Tuple[int, int]
+
+
+class Shard:
+    """
+    One wave being scouted in one channel: the wave itself, where it's
+    saved, and the histories of its previous waves.
+
+    Handlers hold `lock` while working on the wave, so messages for the
+    same wave are handled one at a time, in order, even when a handler has
+    to wait on discord halfway through.
+
+    On a standby instance (`following`) the wave is never changed here,
+    only kept up to date with what the active instance saves by `follow`.
+    Otherwise changes are saved under lease `epoch`, fenced by `fence`, see
+    `WaveStore.start`.
+    """
+
+    def __init__(self, key: ShardKey, store_path: str, following: bool = False,
+            epoch: int = 0, fence=None, past_waves: deque = None):
+        self.key = key
+        self.store_path = store_path
+        self.following = following
+        self.store = WaveStore(store_path, WAVE_SNAPSHOT_EVERY)
+        self.wave, self.recovery = self.store.load(follow=following, epoch=epoch, fence=fence)
+        # World histories of previous waves, most recent first
+        if past_waves is None:
+            past_waves = deque(maxlen=HISTORY_KEEP_WAVES)
+        self.past_waves = past_waves
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    def reset_wave(self):
+        self.wave.history.ended = time.time()
+        self.past_waves.appendleft(self.wave.history)
+        board = self.wave.listboard
+        self.wave = WbsWave()
+        board.move_to(self.wave)
+        self.wave.store = self.store
+        self.store.snapshot(self.wave)
+
+    def get_history(self, waves_ago: int = 0):
+        """ World history of the current wave, or of `waves_ago` waves before """
+        if waves_ago == 0:
+            return self.wave.history
+        if 0 < waves_ago <= len(self.past_waves):
+            return self.past_waves[waves_ago - 1]
+        return None
+
+    async def follow(self):
+        """ Catches up with what the active instance saved, off the event loop """
+        async with self.lock:
+            if self.following:
+                loop = asyncio.get_event_loop()
+                self.wave = await loop.run_in_executor(None, self.store.follow, self.wave)
+
+    async def promote(self, epoch: int, fence=None):
+        """ Catch up with the last saved changes and start saving our own """
+        await self.follow()
+        self.following = False
+        self.store.start(self.wave, epoch, fence)
+
+    async def demote(self):
+        """ Stop saving changes, another instance is taking over """
+        async with self.lock:
+            await self.store.aclose()
+            self.following = True
+            self.store = WaveStore(self.store_path, WAVE_SNAPSHOT_EVERY)
+            self.wave, _ = self.store.load(follow=True)
+
+    async def close(self):
+        await self.store.aclose()
+
+
+class ShardMap:
+    """
+    Every wave the bot is keeping track of, by the channel it's scouted in.
+
+    The main wave is shared by all of `RESPONSE_CHANNELS` and is always
+    loaded. Each of `EXTRA_WAVE_CHANNELS` has a wave of its own, which is
+    only loaded (from its saved state, if any) once somebody uses it, and
+    unloaded again by `evict_idle` after `idle_secs` without use.
+
+    Channels are mapped to their wave with a single dict lookup, so routing
+    a message costs the same no matter how many waves there are.
+    """
+
+    def __init__(self, idle_secs: float = SHARD_IDLE_SECS, following: bool = False):
+        self.idle_secs = idle_secs
+        self.following = following
+        # Lease epoch and fence new shards save changes under, see `promote`
+        self.epoch = 0
+        self.fence = None
+        self.main_key = (GUILD_WBS_UNITED, CHANNEL_WAVE_CHAT)
+
+        # Channel id -> key of the wave scouted there
+        self.routes: Dict[int, ShardKey] = {c: self.main_key for c in RESPONSE_CHANNELS}
+        for channel, guild in EXTRA_WAVE_CHANNELS.items():
+            self.routes[channel] = (guild, channel)
+
+        self.loaded: Dict[ShardKey, Shard] = dict()
+        # Histories of the previous waves of every shard ever loaded, which
+        # aren't saved on disk, so they outlive the shard being unloaded
+        self.past_waves: Dict[ShardKey, deque] = dict()
+        # Stores of unloaded shards that may still be writing their last batch
+        self.closing: Dict[ShardKey, WaveStore] = dict()
+        self.main = self.get(self.main_key)
+
+    def store_path(self, key: ShardKey):
+        # Keep the main wave where it was saved before there were shards
+        if key == self.main_key:
+            return WAVE_STATE_PATH
+        return f'{WAVE_STATE_PATH}-{key[0]}-{key[1]}'
+
+    def get(self, key: ShardKey) -> Shard:
+        shard = self.loaded.get(key)
+        if shard is None:
+            closing = self.closing.pop(key, None)
+            if closing:
+                # Loaded again right after being unloaded, what it saved last
+                # has to be on disk before it's read back. That's one fsync
+                # at most, so just wait for it
+                closing.wait_closed()
+            past_waves = self.past_waves.setdefault(key, deque(maxlen=HISTORY_KEEP_WAVES))
+            shard = self.loaded[key] = Shard(key, self.store_path(key), self.following,
+                self.epoch, self.fence, past_waves)
+        shard.last_used = time.monotonic()
+        return shard
+
+    def for_channel(self, channel_id: int) -> Shard:
+        """ Shard for messages in `channel_id`, or None if it has no wave """
+        key = self.routes.get(channel_id)
+        if key is None:
+            return None
+        return self.get(key)
+
+    def __iter__(self):
+        return iter(list(self.loaded.values()))
+
+    async def promote(self, epoch: int, fence=None):
+        self.following = False
+        self.epoch = epoch
+        self.fence = fence
+        for shard in self:
+            await shard.promote(epoch, fence)
+
+    async def demote(self):
+        self.following = True
+        for shard in self:
+            await shard.demote()
+
+    async def evict_idle(self):
+        """
+        Unloads waves that haven't been used in `idle_secs`, except the main
+        one and any that are busy. Their state stays saved on disk and the
+        histories of their previous waves are kept in `past_waves`. The
+        history of the current wave is rebuilt from the saved state once
+        reloaded, so changes from before the last snapshot only show up as
+        they were at that snapshot. Returns the keys unloaded.
+        """
+        cutoff = time.monotonic() - self.idle_secs
+        evicted = [key for key, s in self.loaded.items()
+            if key != self.main_key and s.last_used < cutoff and not s.lock.locked()]
+        shards = [self.loaded.pop(key) for key in evicted]
+        for shard in shards:
+            self.closing[shard.key] = shard.store
+        for shard in shards:
+            await shard.close()
+            if self.closing.get(shard.key) is shard.store:
+                del self.closing[shard.key]
+        return evicted
@@ -0,0 +1,83 @@
+import asyncio, traceback
+import discord
+
+from models import debug
+
+
+class VoiceRoleReconciler:
+    """
+    Keeps `role` on exactly the members that are in the voice channel
+    `channel_id`.
+
+    Voice events only mark members as dirty. Dirty members are reconciled
+    in batches after a short window, re-reading their current voice state,
+    so somebody who joins and leaves within the window costs no API calls.
+    Role edits are spaced out by `interval` seconds to stay clear of rate
+    limits. `sweep` reconciles everybody, for startup and reconnects where
+    we may have missed events.
+    """
+
+    def __init__(self, guild: discord.Guild, role: discord.Role, channel_id: int,
+            window: float = 2.0, interval: float = 0.5):
+        self.guild = guild
+        self.role = role
+        self.channel_id = channel_id
+        self.window = window
+        self.interval = interval
+        self.dirty = dict()
+        self.task = None
+
+    def wants_role(self, member: discord.Member):
+        return bool(member.voice and member.voice.channel
+            and member.voice.channel.id == self.channel_id)
+
+    def has_role(self, member: discord.Member):
+        return any(r.id == self.role.id for r in member.roles)
+
+    def touch(self, member: discord.Member):
+        """ Schedule `member` to be reconciled in the next batch """
+        self.dirty[member.id] = member
+        if not self.task:
+            self.task = asyncio.ensure_future(self._run_batches())
+
+    async def _run_batches(self):
+        try:
+            while self.dirty:
+                await asyncio.sleep(self.window)
+                members = list(self.dirty.values())
+                self.dirty = dict()
+                await self.reconcile(members)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.task = None
+
+    async def reconcile(self, members):
+        """ Apply role diffs for `members`. Returns (num added, num removed) """
+        added, removed = 0, 0
+        for m in members:
+            want, have = self.wants_role(m), self.has_role(m)
+            if want == have:
+                continue
+
+            try:
+                if want:
+                    await m.add_roles(self.role, reason='Joined voice', atomic=True)
+                    added += 1
+                else:
+                    await m.remove_roles(self.role, reason='Left voice', atomic=True)
+                    removed += 1
+            except discord.HTTPException:
+                traceback.print_exc()
+            await asyncio.sleep(self.interval)
+
+        debug(f'Voice roles reconciled: {added} added, {removed} removed')
+        return added, removed
+
+    async def sweep(self):
+        """ Reconcile everybody in voice or holding the role """
+        voice = self.guild.get_channel(self.channel_id)
+        members = {m.id: m for m in self.role.members}
+        if voice:
+            members.update({m.id: m for m in voice.members})
+        return await self.reconcile(members.values())
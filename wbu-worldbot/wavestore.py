@@ -0,0 +1,300 @@
+import asyncio, atexit, json, os, queue, threading, time
+from datetime import datetime, timedelta, timezone
+
+from config import *
+from models import *
+from wbstime import get_prev_wave_datetime
+
+# Sentinel telling the writer thread to flush and exit
+_CLOSE = object()
+
+
+class WaveStore:
+    """
+    Durable copy of the current wave's state, so a crash or redeploy doesn't
+    lose every call made so far.
+
+    State is kept as a snapshot (`path.snap`) plus a write-ahead log
+    (`path.wal`) of every change applied since. The wave calls `append` with
+    a record for each change; records are numbered and handed to a
+    background thread, which writes whatever is pending as one batch and
+    fsyncs it, so the event loop never waits on the disk. Every
+    `snapshot_every` records the whole wave is written out as a new
+    snapshot and the log is truncated.
+
+    `load` rebuilds the wave by reading the snapshot and replaying the log
+    records numbered after it. A torn last line from a crash mid-write is
+    ignored. State from before the last auto reset is discarded.
+
+    Standby instances open the same files with `load(follow=True)` and call
+    `follow` to keep tailing the log, then `start` once they take over.
+
+    Records and snapshots are stamped with the writer's lease epoch, and
+    replayed in (epoch, seq) order, skipping anything that sorts before what
+    was already applied. So if an instance that lost the lease still writes
+    a few records after the new one took over and snapshotted, they're
+    ignored rather than mixed in under colliding sequence numbers. The
+    writer thread also checks `fence` before every write and stops writing
+    for good once it says we no longer hold the lease.
+    """
+
+    def __init__(self, path: str, snapshot_every: int = 500):
+        self.snap_path = path + '.snap'
+        self.wal_path = path + '.wal'
+        self.snapshot_every = snapshot_every
+        self.closed = False
+
+        # Sequence number of the last record, and of the last snapshot
+        self.seq = 0
+        self.snap_seq = 0
+        # Lease epoch we write under, or of the last record read
+        self.epoch = 0
+        self.fence = None
+        self.fenced = False
+
+        # What `follow` has seen so far
+        self._snap_mtime = None
+        self._wal_pos = 0
+
+        self._queue = queue.SimpleQueue()
+        self._file = None
+        self._thread = threading.Thread(target=self._run, name=f'wavestore-{path}', daemon=True)
+
+    # Recovery
+    # ========
+
+    def load(self, now: datetime = None, follow: bool = False, epoch: int = 0, fence=None):
+        """
+        Returns (wave, stats), the recovered wave or a new one if there's
+        nothing to recover, and a dict of recovery stats for logging.
+
+        Unless `follow`, starts writing under `epoch` and `fence` (see
+        `start`), so this must be called before `append`. With `follow` the
+        files are only read, for a standby to keep up with another
+        instance's changes through `follow`.
+        """
+        start = time.perf_counter()
+        wave, snap, replayed = self._rebuild(now)
+        if not follow:
+            self.start(wave, epoch, fence)
+        stats = {
+            'snapshot': snap is not None,
+            'replayed': replayed,
+            'worlds': sum(w.is_modified() for w in wave.get_worlds()),
+            'ms': (time.perf_counter() - start) * 1000,
+        }
+        return wave, stats
+
+    def _rebuild(self, now: datetime = None):
+        now = now or datetime.now(timezone.utc)
+        # The wave is auto reset an hour after it starts
+        reset_at = get_prev_wave_datetime(now - timedelta(hours=1)) + timedelta(hours=1)
+
+        snap, records = self.read()
+        wave = WbsWave()
+        replayed = 0
+        self.seq = self.snap_seq = self.epoch = 0
+        saved = snap.get('ts', 0) if snap else 0
+        if records:
+            saved = max(saved, records[-1]['ts'])
+
+        if saved >= reset_at.timestamp():
+            if snap:
+                wave.restore(snap['wave'], snap['ts'])
+                self.seq = self.snap_seq = snap['seq']
+                self.epoch = snap.get('epoch', 0)
+            for rec in records:
+                replayed += self._apply(wave, rec)
+        else:
+            snap = None
+        return wave, snap, replayed
+
+    def read(self):
+        """ Returns (snapshot or None, list of log records) as found on disk """
+        snap = None
+        try:
+            # Stat first, so a snapshot replaced while reading is noticed by
+            # the next `follow`
+            self._snap_mtime = os.stat(self.snap_path).st_mtime_ns
+            with open(self.snap_path, encoding='utf-8') as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        self._wal_pos = 0
+        return snap, self._read_wal()
+
+    def _read_wal(self):
+        """ Log records from `_wal_pos` on, advancing it past them """
+        try:
+            with open(self.wal_path, 'rb') as f:
+                f.seek(self._wal_pos)
+                data = f.read()
+        except OSError:
+            return []
+
+        records = []
+        pos = 0
+        # Only take whole lines, the last one may still be being written
+        while True:
+            end = data.find(b'\n', pos)
+            if end == -1:
+                break
+            try:
+                records.append(json.loads(data[pos:end]))
+            except json.JSONDecodeError:
+                # Torn write, nothing after it made it to disk intact
+                break
+            pos = end + 1
+        self._wal_pos += pos
+        return records
+
+    def follow(self, wave: 'WbsWave'):
+        """
+        For standbys, brings `wave` up to date with the changes the active
+        instance has saved since the last call. Returns the wave, which is a
+        new one if the active instance has taken a snapshot since.
+        """
+        try:
+            snap_mtime = os.stat(self.snap_path).st_mtime_ns
+            wal_size = os.path.getsize(self.wal_path)
+        except OSError:
+            return wave
+
+        if snap_mtime != self._snap_mtime or wal_size < self._wal_pos:
+            wave, _, _ = self._rebuild()
+            return wave
+        for rec in self._read_wal():
+            self._apply(wave, rec)
+        return wave
+
+    def _apply(self, wave: 'WbsWave', rec: dict):
+        """ Applies `rec` unless it's from before what's applied already """
+        epoch = rec.get('epoch', 0)
+        if (epoch, rec['seq']) <= (self.epoch, self.seq):
+            return False
+        wave.apply_record(rec)
+        self.epoch, self.seq = epoch, rec['seq']
+        return True
+
+    def start(self, wave: 'WbsWave', epoch: int = 0, fence=None):
+        """
+        Starts recording the changes to `wave`, from a snapshot of it.
+        Everything written is stamped with `epoch`, and if given, `fence()`
+        is called on the writer thread before each write and has to return
+        True for it to go ahead.
+        """
+        self.epoch = epoch
+        self.fence = fence
+        self._file = open(self.wal_path, 'a', encoding='utf-8')
+        self._thread.start()
+        atexit.register(self.close)
+        self.snapshot(wave)
+        wave.store = self
+
+    # Writing
+    # =======
+
+    def append(self, wave: 'WbsWave', rec: dict):
+        """ Durably record a change to `wave`, snapshotting if due """
+        if self.closed or self.fenced:
+            return
+        self.seq += 1
+        rec['seq'] = self.seq
+        rec['epoch'] = self.epoch
+        rec['ts'] = time.time()
+        self._queue.put(('rec', rec))
+        if self.seq - self.snap_seq >= self.snapshot_every:
+            self.snapshot(wave)
+
+    def snapshot(self, wave: 'WbsWave'):
+        """
+        Write out all of `wave` and drop the log before it. Serialising happens
+        here so later changes can't leak in, writing happens on the thread.
+        """
+        if self.closed or self.fenced:
+            return
+        self.snap_seq = self.seq
+        snap = {'seq': self.seq, 'epoch': self.epoch, 'ts': time.time(), 'wave': wave.to_dict()}
+        self._queue.put(('snap', snap))
+
+    def _stop(self):
+        """ Stops taking changes and tells the writer to finish up, False if it wasn't running """
+        # Stores come and go with their shards, don't keep closed ones around
+        # until exit
+        atexit.unregister(self.close)
+        if self.closed or not self._thread.is_alive():
+            return False
+        self.closed = True
+        self._queue.put(_CLOSE)
+        return True
+
+    def close(self):
+        """ Flush everything appended so far and stop the writer thread """
+        if self._stop():
+            self._thread.join()
+
+    async def aclose(self):
+        """ `close` for the event loop, which waits for the last write off it """
+        if self._stop():
+            await asyncio.get_running_loop().run_in_executor(None, self.wait_closed)
+
+    def wait_closed(self):
+        """ Blocks until a closed store's last write is on disk """
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # Take everything else that's pending so it shares one fsync
+            try:
+                while True:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if not self.fenced and self.fence and not self.fence():
+                # Another instance took over, anything we write now would
+                # only get in its way
+                self.fenced = True
+                print(f'[LOG] Lost the lease, no longer writing {self.wal_path}')
+
+            lines = []
+            done = False
+            for item in items:
+                if item is _CLOSE:
+                    done = True
+                    break
+                kind, data = item
+                if self.fenced:
+                    continue
+                if kind == 'snap':
+                    # Records before the snapshot are in it, don't bother
+                    # writing them
+                    lines = []
+                    self._write_snapshot(data)
+                else:
+                    lines.append(json.dumps(data, ensure_ascii=False))
+
+            if lines:
+                self._file.write('\n'.join(lines) + '\n')
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            if done:
+                break
+        self._file.close()
+
+    def _write_snapshot(self, snap: dict):
+        tmp = self.snap_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(snap, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snap_path)
+
+        # If we crash before this, `load` skips the records that are already
+        # in the snapshot by their sequence numbers. The log stays open for
+        # appending, so writes from an instance that lost the lease but
+        # hasn't noticed yet land after ours instead of over them
+        self._file.truncate(0)
@@ -1,4 +1,4 @@
-import math, pytz, inspect
+import bisect, functools, math
 from datetime import datetime, timezone, timedelta
 
 WBS_TIME_DB = {
@@ -11,60 +11,93 @@ WBS_TIME_DB = {
     6: [5, 12, 19],
 }
 
+WEEK_SECS = 7*24*60*60
+
+# Wave start times as seconds since Monday 00:00 UTC, sorted
+WAVE_OFFSETS = sorted(day*24*60*60 + hr*60*60
+    for day, hours in WBS_TIME_DB.items() for hr in hours)
+
+# (pytz zone, label) for each timezone shown in `next_wave_info`
+INFO_TIMEZONES = [
+    ('US/Eastern', 'US/Eastern'),
+    ('US/Central', 'US/Central'),
+    ('US/Pacific', 'US/Pacific'),
+    ('Europe/Paris', 'EU/Central'),
+    ('Europe/Sofia', 'EU/Eastern'),
+    ('Europe/London', 'UK'),
+    ('Singapore', 'UTC+8'),
+    ('Australia/Melbourne', 'Australia/Eastern'),
+]
+
 def get_utctime():
     return datetime.now().astimezone(timezone.utc)
 
+def get_week_start(current: datetime):
+    """ Monday 00:00 UTC of the week `current` is in """
+    cur = current.astimezone(timezone.utc)
+    day = cur.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day - timedelta(days=day.weekday())
+
+def get_upcoming_waves(current: datetime, n: int = 1):
+    """ Datetimes of the next `n` waves strictly after `current` """
+    cur = current.astimezone(timezone.utc)
+    start = get_week_start(cur)
+    offset = (cur - start).total_seconds()
+    i = bisect.bisect_right(WAVE_OFFSETS, offset)
+
+    waves = []
+    for k in range(i, i + n):
+        weeks, j = divmod(k, len(WAVE_OFFSETS))
+        waves.append(start + timedelta(seconds=weeks*WEEK_SECS + WAVE_OFFSETS[j]))
+    return waves
+
 def get_next_wave_datetime(current: datetime):
     """ Get next wave's datetime relative to the current time specified in args. """
-    cur = current.astimezone(timezone.utc)
-    day = cur.weekday()
-    waves_today = WBS_TIME_DB[day]
+    return get_upcoming_waves(current, 1)[0]
 
-    next_wave = None
+def get_prev_wave_datetime(current: datetime):
+    """ Get the datetime of the latest wave at or before `current` """
+    cur = current.astimezone(timezone.utc)
+    start = get_week_start(cur)
+    offset = (cur - start).total_seconds()
+    weeks, j = divmod(bisect.bisect_right(WAVE_OFFSETS, offset) - 1, len(WAVE_OFFSETS))
+    return start + timedelta(seconds=weeks*WEEK_SECS + WAVE_OFFSETS[j])
 
-    # Find the hour after the current one
-    for wh in waves_today:
-        actual_dt = cur.replace(hour=wh, minute=0, second=0, microsecond=0)
-        if actual_dt > cur:
-            return actual_dt
 
-    # Next wave is tomorrow since we didn't find an hour
-    if next_wave == None:
-        tmr_weekday = (day + 1) % 7
-        hr = WBS_TIME_DB[tmr_weekday][0]
+@functools.lru_cache(maxsize=None)
+def get_zone(name: str):
+    # Only `next_wave_info` needs pytz, so it's not loaded until someone asks
+    import pytz
+    return pytz.timezone(name)
 
-        tomorrow = cur + timedelta(days=1)
-        return tomorrow.replace(hour=hr, minute=0, second=0, microsecond=0)
+@functools.lru_cache(maxsize=64)
+def get_wave_zone_times(wave: datetime):
+    """
+    Wave time rendered in each of `INFO_TIMEZONES`. Cached per wave, which
+    is only ever invalid if the tz database itself changes.
+    """
+    TIME_FORMAT = '%H:00'
+    return '\n'.join(
+        f'{wave.astimezone(get_zone(zone)).strftime(TIME_FORMAT)} in {label}'
+        for zone, label in INFO_TIMEZONES)
 
 
 def next_wave_info():
     cur = get_utctime()
     next_wave = get_next_wave_datetime(cur)
 
-    deltasecs = (next_wave - cur).seconds
+    deltasecs = int((next_wave - cur).total_seconds())
     deltahr = math.floor(deltasecs / 3600.0)
     deltamins = math.floor((deltasecs % 3600) / 60.0)
 
-    TIME_FORMAT = '%H:00'
-    n = next_wave
-
-    def intz(time, zonename):
-        return time.astimezone(pytz.timezone(zonename)).strftime(TIME_FORMAT)
+    return f'{deltahr}:{deltamins:02} until the next wave.\n\n' + \
+        f'Next wave is at:\n{get_wave_zone_times(next_wave)}'
 
-    return inspect.cleandoc(
-        f"""
-        {deltahr}:{deltamins:02} until the next wave.
 
-        Next wave is at:
-        {intz(n, 'US/Eastern')} in US/Eastern
-        {intz(n, 'US/Central')} in US/Central
-        {intz(n, 'US/Pacific')} in US/Pacific
-        {intz(n, 'Europe/Paris')} in EU/Central
-        {intz(n, 'Europe/Sofia')} in EU/Eastern
-        {intz(n, 'Europe/London')} in UK
-        {intz(n, 'Singapore')} in UTC+8
-        {intz(n, 'Australia/Melbourne')} in Australia/Eastern
-        """)
+def week_schedule():
+    """ Every wave in the next 7 days, as discord timestamps """
+    waves = get_upcoming_waves(get_utctime(), len(WAVE_OFFSETS))
+    return '\n'.join(f'<t:{int(w.timestamp())}:F> (<t:{int(w.timestamp())}:R>)' for w in waves)
 
 
 def time_to_next_wave(current=None):
@@ -78,4 +111,14 @@ def time_to_next_wave(current=None):
         current = now
     
     next_wave = get_next_wave_datetime(current)
-    return next_wave, next_wave - now
\ No newline at end of file
+    return next_wave, next_wave - now
+
+
+def wave_offset(delta: timedelta):
+    """
+    Scheduler rule for firing `delta` relative to the start of every wave,
+    e.g. `wave_offset(timedelta(minutes=-15))` fires 15 minutes before.
+    """
+    def rule(after: datetime):
+        return get_next_wave_datetime(after - delta) + delta
+    return rule
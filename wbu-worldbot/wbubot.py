@@ -1,23 +1,36 @@
-import asyncio, discord, traceback, uuid
-from io import TextIOWrapper
+import asyncio, discord, functools, logging, time, traceback, uuid
 from datetime import datetime, timedelta, timezone
 from discord.ext import commands
 
 import parser
+from lease import Lease
+from logsink import LogSink
+from metrics import (REGISTRY, ON_MESSAGE, COMMAND, DISCORD_SEND, LOOP_LAG, LOOP_LAG_LAST,
+    ERRORS, RATELIMITS, RateLimitCounter, sample_loop_lag, serve_metrics)
+from outbox import Outbox
+from scheduler import Scheduler, every
+from voiceroles import VoiceRoleReconciler
+from shards import Shard, ShardMap
 from wbstime import *
 from config import *
 from models import *
 
 
 class WbuBot():
-    def __init__(self, client: commands.Bot, msglog: TextIOWrapper, botlog: TextIOWrapper):
+    def __init__(self, client: commands.Bot, msglog: LogSink, botlog: LogSink):
         self.client = client
+        self.outbox = Outbox(client)
+        self.scheduler = Scheduler(log=self.log)
         self.init = False
         self.msglog = msglog
         self.botlog = botlog
         self.uuid = str(uuid.uuid4())
         self.role_textperm_obj = None
-        self.wave = WbsWave()
+        self.voiceroles = None
+        # Only the instance holding the lease responds, see `elect`
+        self.lease = Lease(LEASE_PATH, 'worldbot', self.uuid, LEASE_TTL_SECS)
+        self.active = False
+        self.shards = ShardMap(following=True)
         self.ignoremode = False
 
         # Delay the rest of initialisation to first websocket connection
@@ -28,6 +41,8 @@ class WbuBot():
         # Thus we have to keep track if we've been called before
         if self.init:
             await self.logr('Bot reconnected.')    
+            # We may have missed voice events while disconnected
+            self.client.loop.create_task(self.sweep_voice_roles())
             return
 
         self.init = True
@@ -38,150 +53,254 @@ class WbuBot():
         UUID: {self.uuid}.
         {'DEBUG MODE ENABLED' if DEBUG else ''}
         """))
+        r = self.shards.main.recovery
+        if r['snapshot'] or r['replayed']:
+            await self.logr(f"Recovered wave state: {r['worlds']} worlds with info, "
+                f"{r['replayed']} changes replayed in {r['ms']:.1f}ms.")
 
         # Override message handler because sometimes we don't want to parse
         # stuff as a command
         self.client.event(self.on_message)
 
-        # Create tasks for periodic features
-        self.client.loop.create_task(self.autoreset_bot())
-        self.client.loop.create_task(self.notify_wave())
+        # Schedule periodic features
+        # Reset 1hr after wave, and remind people 15 mins before
+        self.scheduler.add('autoreset', wave_offset(timedelta(hours=1)), self.autoreset_bot)
+        self.scheduler.add('wave reminder', wave_offset(timedelta(minutes=-15)), self.notify_wave)
+        self.scheduler.add('shard eviction', every(timedelta(minutes=10)), self.evict_shards)
+        self.scheduler.start()
+        for job in self.scheduler.jobs():
+            await self.logr(f'Next {job.name} at {job.next_fire:%a %H:%M} UTC')
 
         # Give/take away role when people join/leave voice
-        self.role_textperm_obj = self.client.get_guild(GUILD_WBS_UNITED).get_role(ROLE_TEXT_PERM)
+        guild = self.client.get_guild(GUILD_WBS_UNITED)
+        self.role_textperm_obj = guild.get_role(ROLE_TEXT_PERM)
+        self.voiceroles = VoiceRoleReconciler(guild, self.role_textperm_obj, CHANNEL_VOICE)
         self.client.add_listener(self.on_voice_state_update, 'on_voice_state_update')
+        self.client.loop.create_task(self.sweep_voice_roles())
 
         # Register other misc event listeners
         self.client.add_listener(self.on_err, 'on_command_error')
         self.client.add_listener(self.welcome_msg, 'on_member_join')
 
+        # Metrics, see metrics.py for what's measured
+        self.client.before_invoke(self.before_command)
+        self.client.after_invoke(self.after_command)
+        logging.getLogger('discord.http').addHandler(RateLimitCounter(RATELIMITS))
+        self.client.loop.create_task(sample_loop_lag(LOOP_LAG, LOOP_LAG_LAST))
+        try:
+            await serve_metrics(REGISTRY, '127.0.0.1', METRICS_PORT)
+            self.log(f'Serving metrics at http://127.0.0.1:{METRICS_PORT}/metrics')
+        except OSError as e:
+            # Most likely another instance on this host already has the port
+            self.log(f'Not serving metrics: {e}')
+
+        # Start responding if no other instance is
+        await self.elect()
+        self.client.loop.create_task(self.run_election())
+
     # Logging
     # =======
 
     def log(self, msg: str):
         print(f'[LOG] {msg}')
-        self.botlog.write(f'[LOG] {msg}\n')
+        self.botlog.write(msg=msg)
     
     async def logr(self, msg: str):
-        """ Log both locally and on #worldbot-logs """
+        """
+        Log both locally and on #worldbot-logs. Doesn't wait for the message
+        to be sent, and consecutive lines are merged into one message.
+        """
         self.log(msg)
-        await self.send_to_channel(CHANNEL_BOT_LOG, msg)
+        self.outbox.post(CHANNEL_BOT_LOG, msg, coalesce=True)
     
     # Utilities
     # =========
 
     async def send_to_channel(self, id: int, msg: str):
-        await self.client.get_channel(id).send(msg)
-
-    def reset_wave(self):
-        self.wave = WbsWave()
+        await self.outbox.send(id, msg)
+
+    @property
+    def wave(self) -> WbsWave:
+        """ The main wave, shared by every channel in RESPONSE_CHANNELS """
+        return self.shards.main.wave
+
+    def shard_for(self, channel) -> Shard:
+        """ Shard for a channel, DMs go to the main wave """
+        if isinstance(channel, discord.TextChannel):
+            return self.shards.for_channel(channel.id)
+        return self.shards.main
+
+    def is_silent(self):
+        """ Whether to leave discord alone, as another instance is active """
+        return self.ignoremode or not self.active
+
+    # Leader election
+    # ===============
+
+    async def elect(self):
+        """
+        Renews our lease, or takes it over if the active instance let it
+        expire, and switches between active and standby to match. Standbys
+        keep their copy of the wave state up to date from what the active
+        instance saves, so they can take over with the latest state.
+        """
+        try:
+            active = await self.lease.renew()
+        except Exception as e:
+            # Can't tell if somebody else has it, so don't risk answering twice
+            self.log(f'Lease renewal failed: {e}')
+            active = False
+
+        if active and not self.active:
+            epoch = self.lease.epoch
+            await self.shards.promote(epoch, functools.partial(self.lease.still_held, epoch))
+            self.active = True
+            await self.logr(f'Instance {self.uuid} is now active.')
+            self.client.loop.create_task(self.sweep_voice_roles())
+        elif not active and self.active:
+            self.active = False
+            await self.shards.demote()
+            await self.logr(f'Instance {self.uuid} lost the lease, standing by.')
+        elif not active:
+            for shard in self.shards:
+                await shard.follow()
+
+    async def run_election(self):
+        while True:
+            await asyncio.sleep(LEASE_RENEW_SECS)
+            try:
+                await self.elect()
+            except Exception:
+                self.log(f'Election failed:\n{traceback.format_exc()}')
 
     # Tasks
     # =====
 
+    async def sweep_voice_roles(self):
+        # Only touch roles when active so multiple bots don't conflict
+        if self.is_silent() or not self.voiceroles:
+            return
+        added, removed = await self.voiceroles.sweep()
+        if added or removed:
+            await self.logr(f'Voice role sweep: {added} added, {removed} removed.')
+
     async def autoreset_bot(self):
-        while not self.client.is_closed(): # Loop
-            _, wait_time = time_to_next_wave()
-            sleepsecs = wait_time.seconds + 60*60
-            # Reset 1hr after wave
-            await self.logr(f'Autoreset in {sleepsecs}')
-            await asyncio.sleep(wait_time.seconds + 60*60)
+        # Standbys pick the reset up from the active instance's state
+        if not self.active:
+            return
+        for shard in self.shards:
+            shard.reset_wave()
+        await self.logr('Auto reset triggered.')
 
-            self.reset_wave()
-            await self.logr('Auto reset triggered.')
+    async def evict_shards(self):
+        for guild, channel in await self.shards.evict_idle():
+            self.log(f'Unloaded idle wave for <#{channel}> in guild {guild}')
 
     async def notify_wave(self):
-        while not self.client.is_closed():
-            # We put the actual notification after the sleep because this way,
-            # the 1st time the loop is run we don't immediately notify everybody
-            # on bot startup, instead we wait until the correct time
-            _, wait_time = time_to_next_wave()
-            sleepsecs = wait_time.seconds - 15*60
-            await self.logr(f'Next wave reminder in {sleepsecs}.')
-            await asyncio.sleep(sleepsecs)
-
-            # Don't notify if we're in ignoremode
-            if self.ignoremode:
-                continue
-
-            # Also include time of wave *after* the upcoming one for ease of access
-            now = datetime.now().astimezone(timezone.utc)
-            nextwave, _ = time_to_next_wave(now + timedelta(minutes=60))
-            unixts = int(nextwave.timestamp())
-
-            await self.send_to_channel(CHANNEL_NOTIFY,
-                f'<@&{ROLE_WBS_NOTIFY}> wave in 15 minutes. Please join at <#{CHANNEL_WAVE_CHAT}> and <#{CHANNEL_VOICE}>\n' + 
-                f'The following wave is <t:{unixts}:R> at <t:{unixts}:F>.')
-
-            # Wait for 20 minutes so we start the loop again *after* the wave ends
-            await asyncio.sleep(20 * 60)
+        # Don't notify if another instance is or we're in ignoremode
+        if self.is_silent():
+            return
+
+        # Also include time of wave *after* the upcoming one for ease of access
+        now = datetime.now().astimezone(timezone.utc)
+        nextwave, _ = time_to_next_wave(now + timedelta(minutes=60))
+        unixts = int(nextwave.timestamp())
+
+        await self.send_to_channel(CHANNEL_NOTIFY,
+            f'<@&{ROLE_WBS_NOTIFY}> wave in 15 minutes. Please join at <#{CHANNEL_WAVE_CHAT}> and <#{CHANNEL_VOICE}>\n' + 
+            f'The following wave is <t:{unixts}:R> at <t:{unixts}:F>.')
 
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
-        if self.ignoremode:
+        if self.is_silent():
             return
 
         debug(f'{member}: before {before}, after {after}')
         nowf = datetime.now().astimezone(timezone.utc).strftime('%H:%M:%S')
 
+        # Give/take away the role to view wave text. Role changes are
+        # batched and checked against current voice state, so it's fine to
+        # do this on every event and it may take a couple seconds
+        self.voiceroles.touch(member)
+
         # Somebody joined CHANNEL_VOICE
         if (before.channel == None and
             after.channel and
             after.channel.id == CHANNEL_VOICE):
-            # Give them the role to view wave text
-            # Only give when not in ignoremode so multiple bots don't conflict
-            if not self.ignoremode:
-                await member.add_roles(self.role_textperm_obj, reason='Joined voice', atomic=True)
-
-            await self.send_to_channel(CHANNEL_BOT_LOG,
-                f'{nowf}: __"{member.display_name}" joined__ voice')
+            self.outbox.post(CHANNEL_BOT_LOG,
+                f'{nowf}: __"{member.display_name}" joined__ voice', coalesce=True)
 
         # Somebody left CHANNEL_VOICE
         if ((before.channel and before.channel.id == CHANNEL_VOICE) and
             (after.channel == None or after.channel.id != CHANNEL_VOICE)):
-
-            # Remove perm to view wave text
-            # Only do when not in ignoremode so multiple bots don't conflict
-            if not self.ignoremode:
-                await member.remove_roles(self.role_textperm_obj, reason='Left voice', atomic=True)
-
-            await self.send_to_channel(CHANNEL_BOT_LOG,
-                f'{nowf}: **"{member.display_name}" left** voice')
+            self.outbox.post(CHANNEL_BOT_LOG,
+                f'{nowf}: **"{member.display_name}" left** voice', coalesce=True)
 
 
     async def on_message(self, msgobj: discord.Message):
+        start = time.perf_counter()
+        try:
+            await self.handle_message(msgobj)
+        finally:
+            ON_MESSAGE.observe(time.perf_counter() - start)
+
+    async def handle_message(self, msgobj: discord.Message):
         # Ignore bot messages to prevent infinite loops, including ourselves
         # Also ignore empty messages
         if msgobj.author.bot or not msgobj.content:
             return
 
-        # discord.TextChannel means that it's a text channel in a guild, not DM
-        # Only respond to messages in text channels that are the bot and the help
-        istext = isinstance(msgobj.channel, discord.TextChannel)
-        if istext and not (msgobj.channel.id in RESPONSE_CHANNELS):
+        # Standbys ignore everything, the active instance answers. Except
+        # that one in ignoremode still listens for `.ignoremode disable`, or
+        # it would stay in ignoremode after losing the lease
+        if not self.active and not self.ignoremode:
+            return
+
+        # Only respond to DMs and messages in channels with a wave
+        shard = self.shard_for(msgobj.channel)
+        if not shard:
             return
 
         # Log messages to a logfile
-        self.msglog.write(f'{msgobj.author.display_name}: {msgobj.content}\n')
-        debug(f'{msgobj.author.display_name}: {msgobj.content}')
+        if self.active:
+            self.msglog.write(
+                channel=msgobj.channel.id, author=msgobj.author.display_name,
+                author_id=msgobj.author.id, content=msgobj.content)
+            debug(f'{msgobj.author.display_name}: {msgobj.content}')
         
         # Toggle ignoremode
         if self.ignoremode:
             if msgobj.content == '.ignoremode disable':
                 self.ignoremode = False
-                await msgobj.channel.send('Ignoremode disabled. Back to normal mode.')
+                if self.active:
+                    await msgobj.channel.send('Ignoremode disabled. Back to normal mode.')
             return
 
-        rtype, msg = await parser.process_message(self.wave, msgobj)
-        debug(f'Parser response: {repr(rtype)}, {msg}')
-
-        if rtype == parser.ParserResp.CONTINUE_TO_COMMAND:
-            await self.client.process_commands(msgobj)
-        elif rtype == parser.ParserResp.RESPOND:
-            await msgobj.channel.send(msg)
-        elif rtype == parser.ParserResp.DISCARD:
+        if not self.active:
             return
 
+        # Handle messages for the same wave one at a time, so commands that
+        # wait on discord halfway through don't interleave
+        async with shard.lock:
+            rtype, msg = await parser.process_message(shard.wave, msgobj)
+            debug(f'Parser response: {repr(rtype)}, {msg}')
+
+            if rtype == parser.ParserResp.CONTINUE_TO_COMMAND:
+                await self.client.process_commands(msgobj)
+            elif rtype == parser.ParserResp.RESPOND:
+                send_start = time.perf_counter()
+                await msgobj.channel.send(msg)
+                DISCORD_SEND.labels('respond').observe(time.perf_counter() - send_start)
+            elif rtype == parser.ParserResp.DISCARD:
+                return
+
+    async def before_command(self, ctx: commands.Context):
+        ctx.started = time.perf_counter()
+
+    async def after_command(self, ctx: commands.Context):
+        COMMAND.labels(ctx.command.name).observe(time.perf_counter() - ctx.started)
+
     async def on_err(self, ctx: commands.Context, err):
+        ERRORS.labels('command').inc()
         if isinstance(err, commands.CommandNotFound) and ctx.channel.id == CHANNEL_BOTSPAM:
             return
         await ctx.message.add_reaction(REACT_CROSS)
@@ -191,6 +310,8 @@ class WbuBot():
 
     # Send welcome message
     async def welcome_msg(self, mem: discord.Member):
+        if self.is_silent():
+            return
         dmc = mem.dm_channel
         if not dmc:
             dmc = await mem.create_dm()
@@ -2,13 +2,15 @@
 
 import sys
 from datetime import datetime, time, timedelta
-from bs4 import BeautifulSoup
 import discord
-import requests
 import asyncio
+import inspect
+import json
 import os
 import logging
 import viswax
+from httpfetch import HttpFetcher
+from scheduler import Scheduler, daily_at
 
 CHANNEL_NOTIFY = 842527669085667408
 CHANNEL_BOT_LOG = 804209525585608734
@@ -21,16 +23,9 @@ ROLE_YEWS = 859158679713742889
 ROLE_GOEBIEBANDS = 483236107396317195
 
 
-# Set up logging
-loglv = os.environ.get('LOGLV') or 'INFO'
-loglvn = getattr(logging, loglv.upper(), None)
-logging.basicConfig(
-    filename='wbunotify.log',
-    level=loglvn,
-    format='[%(asctime)s %(levelname)s]: %(message)s')
-
 intents = discord.Intents.default()
 client = discord.Client(intents=intents)
+scheduler = Scheduler(log=logging.info)
 initialised = False
 
 
@@ -44,48 +39,49 @@ async def on_ready():
     logging.info(f'Logged is as {client.user}')
     # await send_to_channel(CHANNEL_NOTIFY, f'WBU Notifier connected')
 
-    client.loop.create_task(create_specific_time_notif(
+    # Fetch the stock a couple minutes early so sending the notification
+    # doesn't have to wait on the wiki
+    scheduler.add('Travelling Merchant prefetch', daily_at(time(hour=0, minute=1)),
+        prefetch_tms)
+
+    add_notif(
         name='Travelling Merchant',
         times=[time(hour=0, minute=3)],
         channel=CHANNEL_NOTIFY,
         msgfn=get_tms_from_template
-    ))
+    )
 
-    client.loop.create_task(create_specific_time_notif(
+    add_notif(
         name='Vis wax',
         times=[time(hour=0, minute=2)],
         channel=CHANNEL_NOTIFY,
         msgfn=get_viswax_pred_msg
-    ))
+    )
 
-    client.loop.create_task(create_specific_time_notif(
+    add_notif(
         name='Reset yews',
         times=[time(hour=23, minute=45)],
         channel=CHANNEL_NOTIFY,
         msgfn=lambda: f'<@&{ROLE_YEWS}> yews starting on world 48.'
-    ))
+    )
 
-    client.loop.create_task(create_specific_time_notif(
+    add_notif(
         name='140 yews',
         times=[time(hour=17, minute=40)],
         channel=CHANNEL_NOTIFY,
         msgfn=lambda: f'<@&{ROLE_YEWS}> yews starting on world 140.'
-    ))
+    )
 
-    client.loop.create_task(create_specific_time_notif(
-        name='Goebiebands noon',
-        times=[time(hour=11, minute=45)],
+    add_notif(
+        name='Goebiebands',
+        times=[time(hour=11, minute=45), time(hour=23, minute=45)],
         channel=CHANNEL_NOTIFY,
         msgfn=lambda: f'<@&{ROLE_GOEBIEBANDS}> starting in 15 minutes.'
-    ))
+    )
 
-    # I can't figure out why it isn't doing it twice, so use the lazy solution
-    client.loop.create_task(create_specific_time_notif(
-        name='Goebiebands reset',
-        times=[time(hour=23, minute=45)],
-        channel=CHANNEL_NOTIFY,
-        msgfn=lambda: f'<@&{ROLE_GOEBIEBANDS}> starting in 15 minutes.'
-    ))
+    scheduler.start()
+    for job in scheduler.jobs():
+        logging.info(f'Notifying about {job.name} at {job.next_fire}')
 
     initialised = True
 
@@ -95,86 +91,106 @@ async def on_message(msg):
     pass
 
 
-# Why we use asyncio sleeps instead of cron
-# This is intended to be a drop-in bot that you can clone and run
-# after changing the constants up top, so I don't want to add addiniotaly
-# config steps with 'copy this into your cron' or 'run this script to
-# copy shit into your cron.d'. This makes everything simple and
-# self-contained
-
-def secs_until_next(target):
-    """
-    Accepts a offset-naive time of day, and returns seconds until the next
-    occurence of that time until now. Everything is assumed to be in UTC.
-    """
-    # Handle everything in offset-naive times
-    assert (target.tzinfo == None)
-    now = datetime.utcnow()
-    if target > now.time():
-        # Cant subtract two datetime.time objects
-        # They have to be datetime objects to get a timedelta
-        targetdt = datetime.combine(datetime.today(), target)
-    else:
-        tmr = datetime.today() + timedelta(days=1)
-        targetdt = datetime.combine(tmr, target)
-    return (targetdt - now).total_seconds()
-
-
 async def send_to_channel(id, msg):
     await client.get_channel(id).send(msg)
 
 
-def create_specific_time_notif(name, times, channel, msgfn):
+def add_notif(name, times, channel, msgfn):
     """
     Params:
-    - times: list of `datetime.time` objects that will determine when
+    - times: list of `datetime.time` objects in UTC that will determine when
       the message will go out
     - channel: which channel to send the message
-    - msgfn: message to call with time of day for the ping message
+    - msgfn: function returning the ping message, or a coroutine for it
     """
     async def notiffn():
-        while not client.is_closed():
-            mindelta = 60 * 60 * 24
-            logging.debug(f'Searching minimum time for {name}')
-            for t in times:
-                s = secs_until_next(t)
-                logging.debug(f'{s} secs to {t}')
-                mindelta = min(mindelta, s)
-            logging.info(f'Notifying about {name} in {mindelta/60/60:5} hours')
-            await asyncio.sleep(delay=mindelta)
+        msg = msgfn()
+        if inspect.isawaitable(msg):
+            msg = await msg
+        logging.info(f'Notifying about {name}')
+        await send_to_channel(channel, msg)
+
+    return scheduler.add(name, daily_at(*times), notiffn)
 
-            msg = msgfn()
-            logging.info(f'Notifying about {name}')
-            await send_to_channel(channel, msg)
 
-            # Safety wait so it doesn't double-notify
-            await asyncio.sleep(delay=60)
+USER_AGENT = 'wbu_notify_bot (contact@unknownpriors.com or @unknownpriors#9144)'
+TMS_HEADERS = {'user-agent': USER_AGENT}
+TMS_ENDPOINT = 'https://api.weirdgloop.org/runescape/tms/current'
+# Can be pointed somewhere else, e.g. at tms_fixture.py for testing
+TMS_TEMPLATE_ENDPOINT = os.environ.get('TMS_TEMPLATE_ENDPOINT') or \
+    'https://runescape.wiki/api.php?format=json&action=parse&prop=text&disablelimitreport=1&text={{Travelling%20Merchant/api}}'
 
-    return notiffn()
+http = HttpFetcher(headers=TMS_HEADERS)
 
+# Stock only changes at 00:00 UTC, so it's cached by UTC date. The wiki
+# takes a while to catch up after that, so stock that's the same as the day
+# before is taken to be the old stock and isn't cached. It's fetched again
+# every TMS_STALE_RETRY_SECS, up to TMS_STALE_RETRIES times
+tms_cache = dict()
+tms_lock = asyncio.Lock()
+TMS_STALE_RETRY_SECS = 60
+TMS_STALE_RETRIES = 15
 
-def get_tms_message():
-    # Can switch to aiohttp if needed
+
+async def get_tms_message():
     TMS_PARAMS = {'lang': 'en'}
-    r = requests.get(TMS_ENDPOINT, params=TMS_PARAMS, headers=TMS_HEADERS)
-    j = r.json()
+    j = json.loads(await http.get_text(TMS_ENDPOINT, params=TMS_PARAMS))
     stock = ', '.join(j[1:])
     return f'<@&{ROLE_TMS}> stock today: {stock}'
 
 
-USER_AGENT = 'wbu_notify_bot (contact@unknownpriors.com or @unknownpriors#9144)'
-TMS_HEADERS = {'user-agent': USER_AGENT}
-TMS_ENDPOINT = 'https://api.weirdgloop.org/runescape/tms/current'
-TMS_TEMPLATE_ENDPOINT = 'https://runescape.wiki/api.php?format=json&action=parse&prop=text&disablelimitreport=1&text={{Travelling%20Merchant/api}}'
+async def fetch_tms_stock():
+    text = await http.get_text(TMS_TEMPLATE_ENDPOINT)
+    j = json.loads(text).get('parse').get('text').get('*')
+    # html.parser is only needed once a day, don't load it at startup
+    from tmsparse import extract_tms_names
+    return extract_tms_names(j)
 
 
-def get_tms_from_template():
-    r = requests.get(TMS_TEMPLATE_ENDPOINT, headers=TMS_HEADERS)
-    j = r.json().get('parse').get('text').get('*')
-    b = BeautifulSoup(j, 'html.parser')
-    spans = b.find_all('span', {'class': 'name'})
-    names = [s.text for s in spans]
-    stock = ', '.join(names)
+async def get_tms_stock(retries: int = TMS_STALE_RETRIES):
+    """
+    Today's stock, waiting for the wiki to update it if it still has
+    yesterday's. If it hasn't after `retries` tries, returns what it has
+    without caching it. Without yesterday's stock to compare to, e.g. on the
+    first day after a restart, whatever is fetched is trusted.
+    """
+    # Only one fetch at a time, so the notification waits for a prefetch
+    # that's still retrying instead of fetching alongside it
+    async with tms_lock:
+        today = datetime.utcnow().date()
+        if today in tms_cache:
+            return tms_cache[today]
+
+        yesterday = tms_cache.get(today - timedelta(days=1))
+        for attempt in range(retries + 1):
+            stock = await fetch_tms_stock()
+            if stock != yesterday:
+                break
+            if attempt < retries:
+                logging.info(f'Travelling Merchant stock not updated yet, retrying in {TMS_STALE_RETRY_SECS}s')
+                await asyncio.sleep(TMS_STALE_RETRY_SECS)
+        else:
+            logging.warning('Travelling Merchant stock still the same as yesterday, not caching it')
+            return stock
+
+        # Only keep today's stock, and yesterday's to compare tomorrow's to
+        for day in list(tms_cache):
+            if day != today - timedelta(days=1):
+                del tms_cache[day]
+        tms_cache[today] = stock
+        return stock
+
+
+async def prefetch_tms():
+    try:
+        await get_tms_stock()
+    except Exception:
+        # The notification will try again when it goes out
+        logging.exception('Failed to prefetch Travelling Merchant stock')
+
+
+async def get_tms_from_template():
+    stock = ', '.join(await get_tms_stock())
     return f'<@&{ROLE_TMS}> stock today: {stock}'
 
 
@@ -183,6 +199,17 @@ def get_viswax_pred_msg() -> str:
     return f'<@&{ROLE_VIS_WAX} predicted runes for today:\n{msg}'
 
 
-if len(sys.argv) < 2:
-    print("Usage: ./wbunotify.py <token>")
-client.run(sys.argv[1])
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: ./wbunotify.py <token>")
+        sys.exit(1)
+
+    # Set up logging
+    loglv = os.environ.get('LOGLV') or 'INFO'
+    loglvn = getattr(logging, loglv.upper(), None)
+    logging.basicConfig(
+        filename='wbunotify.log',
+        level=loglvn,
+        format='[%(asctime)s %(levelname)s]: %(message)s')
+
+    client.run(sys.argv[1])